@@ -1,20 +1,145 @@
-import sqlite3
+import asyncio
+import contextlib
+import logging
+import time
+import traceback
 
+import aiohttp
 from discord.ext import commands
+from discord.webhook import async_ as webhook_async
+
+import metrics
+import migrations
+from config import Config
+from database import Database
+from modules.conversations import ConversationRouter
+from modules.errorhandler import ErrorStore
+
+PROCESS_START = time.perf_counter()  # main imports this module first, close enough to the process start
 
 
 class CAGBot(commands.Bot):
     instance: 'CAGBot' = None
 
-    def __init__(self, db: sqlite3.Cursor, connection: sqlite3.Connection, config: dict, **kwargs):
+    def __init__(self, db: Database, config: Config | dict, **kwargs):
         super().__init__(**kwargs)
         self.db = db
-        self.connection = connection
-        self.config = config
+        self.config = config if isinstance(config, Config) else Config(None, config)
         self.all_cogs, self.loaded_cogs, self.unloaded_cogs = [], [], []
         self.COG_FILE = "COGS.txt"
-        self.traceback = {}
+        self.errors = ErrorStore(db, self.config.get_int("error_buffer", 100),
+                                 self.config.get_int("error_history", 5000),
+                                 self.config.get_float("error_notify_interval", 300))
+        self.http_session: aiohttp.ClientSession = None
+        self.conversations = ConversationRouter(self.config.get_float("prompt_timeout", 120))
+        self.metrics = metrics.Metrics()
+        self.metrics_runner = None
+        self.db.observe = self.metrics.observe_sql
+        self.http.request = metrics.timed_request(self.http.request, self.metrics)
+        self.rate_limit_handler = metrics.RateLimitHandler(self.metrics)
+        self.started = False
+        self.timings: list[tuple[str, float]] = []  # startup phases and milestones, in seconds
+        self.milestones: set[str] = set()
 
         with open(self.COG_FILE, "r") as cogs:
             self.all_cogs = [i.rstrip() for i in cogs.readlines()]
 
+    async def setup_hook(self):
+        if self.started:
+            return  # a second login on the same client, everything below is per process
+        self.started = True
+        with self.phase("http session"):
+            self.http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.config.get_int("http_connections", 16), ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=60, sock_connect=10))
+        with self.phase("database"):
+            await self.db.connect()
+            old, new = await self.db.write(migrations.migrate)
+            print(f"Database schema at version {new}" + (f" (migrated from {old})" if old != new else ""))
+            await self.errors.load()
+        # set in the task that goes on to run the gateway, so every event handler inherits it
+        webhook_async.async_context.set(metrics.TimedWebhookAdapter(self.metrics))
+        for logger in ("discord.http", "discord.webhook.async_"):
+            logging.getLogger(logger).addHandler(self.rate_limit_handler)
+        settings = self.config.get("metrics") or {}
+        if settings.get("enabled", False):
+            self.metrics_runner = await self.metrics.serve(settings.get("host", "127.0.0.1"),
+                                                           settings.get("port", 9100))
+        with self.phase("cogs"):
+            await self.load_cogs()
+        self.milestone("setup")
+        print(self.startup_report())
+
+    async def load_cogs(self):
+        # cogs don't depend on each other and mostly wait on the database, so they load side by side
+        async def load(name):
+            start = time.perf_counter()
+            try:
+                await self.load_extension(name)
+            except Exception as e:
+                traceback.print_exc()
+                await self.errors.capture(e, f"loading {name}")
+                self.unloaded_cogs.append(name)
+                return
+            self.loaded_cogs.append(name)
+            self.timings.append((f"  {name}", time.perf_counter() - start))
+
+        await asyncio.gather(*(load(i) for i in self.all_cogs if i not in self.loaded_cogs))
+        print(f"Loaded {len(self.loaded_cogs)} cogs" +
+              (f", failed to load {', '.join(self.unloaded_cogs)}" if self.unloaded_cogs else ""))
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, time.perf_counter() - start))
+
+    def milestone(self, name: str):
+        """Records how long after the process started `name` first happened, later calls are no-ops."""
+        if name in self.milestones:
+            return
+        self.milestones.add(name)
+        elapsed = time.perf_counter() - PROCESS_START
+        self.timings.append((f"{name} (since start)", elapsed))
+        print(f"Reached {name} {elapsed * 1000:.0f}ms after start")
+
+    def startup_report(self) -> str:
+        return "Startup:\n" + "\n".join(f"  {seconds * 1000:>8.1f}ms  {name}" for name, seconds in self.timings)
+
+    def dispatch(self, event_name: str, /, *args, **kwargs):
+        # before any listener runs, so they can all tell a prompt's answers from ordinary messages
+        if event_name == "message":
+            self.conversations.feed(args[0])
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def invoke(self, ctx: commands.Context):
+        start = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            if ctx.command is not None:
+                self.metrics.observe_handler(f"command {ctx.command.qualified_name}", time.perf_counter() - start)
+
+    async def _run_event(self, coro, event_name: str, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            self.metrics.observe_handler(f"listener {getattr(coro, '__qualname__', event_name)}",
+                                         time.perf_counter() - start)
+
+    async def close(self):
+        await super().close()
+        self.conversations.close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        for logger in ("discord.http", "discord.webhook.async_"):
+            logging.getLogger(logger).removeHandler(self.rate_limit_handler)
+        if self.http_session is not None:
+            await self.http_session.close()
+        await self.config.flush()
+        if self.db.writer_task is not None:
+            await self.errors.flush()
+        await self.db.close()
@@ -0,0 +1,370 @@
+"""Replays synthetic traffic through the cogs without a Discord connection.
+
+The bot runs against a temporary database seeded with characters, prefixes, proxies and reminders. Every REST call, from
+the bot's HTTPClient and the webhook adapter alike, is answered by FakeDiscord, and gateway events are built from
+payloads the same way discord.py builds them. Usage:
+
+    python bench.py --characters 2000 --messages 5000 --reactions 2000 --posts 200
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import discord
+from discord.webhook import async_ as webhook_async
+
+import metrics
+from CAGBot import CAGBot
+from database import Database
+
+GUILD_ID = 100
+BOT_ID = 101
+STAFF_ID = 102
+FORUM_ID = 103
+CHANNELS = list(range(200, 210))
+TEMPLATE = r"Name: [^\n]+\nRace: [^\n]+\n(?:[^\n]*\n?)*"
+TRANSACTION_CONTROL = {"BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE"}
+
+
+def timestamp() -> str:
+    return discord.utils.utcnow().isoformat()
+
+
+def user_payload(user_id: int, name: str, bot: bool = False) -> dict:
+    return {"id": user_id, "username": name, "discriminator": "0", "avatar": None, "global_name": None, "bot": bot}
+
+
+def message_payload(message_id: int, channel_id: int, author: dict, content: str = "", guild_id: int = GUILD_ID,
+                    **extra) -> dict:
+    data = {"id": message_id, "channel_id": channel_id, "author": author, "content": content,
+            "timestamp": timestamp(), "edited_timestamp": None, "tts": False, "mention_everyone": False,
+            "mentions": [], "mention_roles": [], "attachments": [], "embeds": [], "pinned": False, "type": 0,
+            "flags": 0}
+    if guild_id is not None:
+        data["guild_id"] = guild_id
+    data.update(extra)
+    return data
+
+
+class TracedDatabase(Database):
+    """Counts the statements run on every connection, transaction control separately."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.queries = self.control = 0
+
+    def open_connection(self, readonly: bool = False):
+        connection = super().open_connection(readonly)
+        connection.set_trace_callback(self.trace)
+        return connection
+
+    def trace(self, sql: str):
+        with self.lock:
+            if sql.lstrip().split(None, 1)[0].upper() in TRANSACTION_CONTROL:
+                self.control += 1
+            else:
+                self.queries += 1
+
+
+class FakeDiscord:
+    """Answers REST calls with plausible payloads after `latency` seconds, counting them per route."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.ids = itertools.count(discord.utils.time_snowflake(discord.utils.utcnow()))
+        self.bot_user = user_payload(BOT_ID, "CAGBot", bot=True)
+        self.webhooks: dict[int, list[dict]] = collections.defaultdict(list)  # channel id -> webhooks
+        self.webhook_channels: dict[int, int] = {}
+
+    def __len__(self):
+        return sum(self.calls.values())
+
+    async def request(self, route, **kwargs):
+        return await self.handle(route, kwargs.get("json") or {})
+
+    async def handle(self, route, payload: dict):
+        self.calls[f"{route.method} {route.path}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        ids = [int(i) for i in re.findall(r"/(\d+)", route.url)]
+        key = f"{route.method} {route.path}"
+        if key == "GET /channels/{channel_id}/webhooks":
+            return self.webhooks[route.channel_id]
+        if key == "POST /channels/{channel_id}/webhooks":
+            webhook = {"id": next(self.ids), "type": 1, "channel_id": route.channel_id, "guild_id": GUILD_ID,
+                       "name": payload.get("name", "hook"), "avatar": None, "token": "token", "user": self.bot_user}
+            self.webhooks[route.channel_id].append(webhook)
+            self.webhook_channels[webhook["id"]] = route.channel_id
+            return webhook
+        if key == "POST /channels/{channel_id}/messages":
+            return message_payload(next(self.ids), route.channel_id, self.bot_user, payload.get("content") or "")
+        if key == "GET /channels/{channel_id}/messages/{message_id}":
+            return message_payload(ids[1], ids[0], self.bot_user, "replied to")
+        if key == "POST /users/@me/channels":
+            return {"id": next(self.ids), "type": 1, "recipients": [user_payload(int(payload["recipient_id"]), "dm")]}
+        if key in ("POST /webhooks/{webhook_id}/{webhook_token}",
+                   "PATCH /webhooks/{webhook_id}/{webhook_token}/messages/{message_id}"):
+            author = user_payload(route.webhook_id, payload.get("username") or "hook", bot=True)
+            message_id = ids[1] if route.method == "PATCH" else next(self.ids)
+            return message_payload(message_id, self.webhook_channels.get(route.webhook_id, 0), author,
+                                   payload.get("content") or "", webhook_id=route.webhook_id)
+        return None
+
+
+class FakeWebhookAdapter(metrics.TimedWebhookAdapter):
+    def __init__(self, fake: FakeDiscord, bot_metrics: metrics.Metrics):
+        super().__init__(bot_metrics)
+        self.fake = fake
+
+    async def request(self, route, session, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self.fake.handle(route, kwargs.get("payload") or {})
+        finally:
+            self.metrics.observe_rest(route.key, time.perf_counter() - start)
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.directory = tempfile.mkdtemp(prefix="cagbot-bench-")
+        self.fake = FakeDiscord(args.latency / 1000)
+        self.config = {
+            "prefix": ">", "server": GUILD_ID, "staff_botspam": STAFF_ID,
+            "database_file": os.path.join(self.directory, "bench.db"),
+            "webhook_rate": [args.webhook_rate, 1.0], "webhook_pool": args.pool,
+            "template_forums": {str(FORUM_ID): "template_regex"}, "template_regex": TEMPLATE,
+        }
+        self.db = TracedDatabase(self.config["database_file"])
+        self.bot = CAGBot(self.db, self.config, command_prefix=">", intents=discord.Intents.all(), help_command=None)
+        self.users = [user_payload(1000 + i, f"user{i}") for i in range(args.users)]
+        self.characters: list[dict] = []
+        self.proxies: set[tuple[int, int]] = set()  # (user id, channel id)
+        self.guild: discord.Guild = None
+        self.results = []
+
+    async def setup(self):
+        bot = self.bot
+        bot.all_cogs = []  # loaded below, once the guild and the data they warm up from exist
+        await bot._async_setup_hook()
+        await bot.setup_hook()
+        # the bot's own instrumentation stays in place so its overhead is part of the numbers
+        bot.http.request = metrics.timed_request(self.fake.request, bot.metrics)
+        bot.http._HTTPClient__session = bot.http_session  # only checked for its type, the fake adapter never uses it
+        webhook_async.async_context.set(FakeWebhookAdapter(self.fake, bot.metrics))
+        state = bot._connection
+        state.user = discord.ClientUser(state=state, data=self.fake.bot_user)
+        self.guild = state._add_guild_from_data(self.guild_payload())
+        for user in self.users:
+            state.store_user(user)
+        await self.db.write(self.seed)
+        bot.all_cogs = ["modules.character", "modules.listeners", "modules.remind"]
+        with bot.phase("cogs"):
+            await bot.load_cogs()
+        print(bot.startup_report())
+
+    def guild_payload(self) -> dict:
+        channels = [{"id": i, "type": 0, "name": f"rp-{i}", "position": n, "permission_overwrites": []}
+                    for n, i in enumerate(CHANNELS)]
+        channels.append({"id": STAFF_ID, "type": 0, "name": "staff-botspam", "position": 98,
+                         "permission_overwrites": []})
+        channels.append({"id": FORUM_ID, "type": 15, "name": "characters", "position": 99,
+                         "permission_overwrites": [], "available_tags": []})
+        members = [{"user": user, "roles": [], "joined_at": timestamp(), "deaf": False, "mute": False, "flags": 0}
+                   for user in self.users + [self.fake.bot_user]]
+        return {"id": GUILD_ID, "name": "Bench", "owner_id": self.users[0]["id"], "channels": channels,
+                "members": members, "member_count": len(members), "threads": [], "emojis": [], "stickers": [],
+                "features": [], "roles": [{"id": GUILD_ID, "name": "@everyone", "permissions": "8", "position": 0,
+                                           "color": 0, "hoist": False, "managed": False, "mentionable": False}]}
+
+    def seed(self, connection):
+        args = self.args
+        for cid in range(1, args.characters + 1):
+            owner = self.random.choice(self.users)["id"]
+            self.characters.append({"id": cid, "owner": owner, "prefix": f"c{cid}:"})
+        connection.executemany(
+            "INSERT INTO characters (id, name, pronouns, race, classes, description, demeanor, info, image, wiki, "
+            "owner) VALUES (?, ?, 'they/them', 'Human', 'Bard', 'A character.', 'Calm', '', '', '', ?)",
+            [(i["id"], f"Character {i['id']}", i["owner"]) for i in self.characters])
+        connection.executemany("INSERT INTO prefixes (cid, prefix) VALUES (?, ?)",
+                               [(i["id"], i["prefix"]) for i in self.characters])
+        for character in self.random.sample(self.characters, min(args.proxies, len(self.characters))):
+            channel = self.random.choice(CHANNELS)
+            if (character["owner"], channel) not in self.proxies:
+                self.proxies.add((character["owner"], channel))
+                connection.execute("INSERT INTO proxies (user_id, cid, channel, thread) VALUES (?, ?, ?, 0)",
+                                   (character["owner"], character["id"], channel))
+        connection.executemany("INSERT INTO channels (id, whitelisted, cooldown, type) VALUES (?, 1, 0, 'text')",
+                               [(i,) for i in CHANNELS])
+        now = time.time()
+        connection.executemany(
+            "INSERT INTO reminders (user_id, channel, time, phrase, jump_url) VALUES (?, ?, ?, 'bench', '')",
+            [(self.random.choice(self.users)["id"], self.random.choice(CHANNELS), now + self.random.uniform(0, 86400))
+             for _ in range(args.reminders)])
+
+    def message(self, channel_id: int, user: dict, content: str, **extra) -> discord.Message:
+        channel = self.bot.get_channel(channel_id)
+        member = {"roles": [], "joined_at": timestamp(), "deaf": False, "mute": False, "flags": 0}
+        return discord.Message(state=self.bot._connection, channel=channel,
+                               data=message_payload(next(self.fake.ids), channel_id, user, content, member=member,
+                                                    **extra))
+
+    def rp_messages(self) -> list[discord.Message]:
+        users = {i["id"]: i for i in self.users}
+        messages = []
+        for _ in range(self.args.messages):
+            roll = self.random.random()
+            if roll < 0.4:  # prefixed
+                character = self.random.choice(self.characters)
+                messages.append(self.message(self.random.choice(CHANNELS), users[character["owner"]],
+                                             f"{character['prefix']}Hello there, how are you?"))
+            elif roll < 0.5 and self.proxies:  # proxied session
+                user_id, channel_id = self.random.choice(sorted(self.proxies))
+                messages.append(self.message(channel_id, users[user_id], "*waves* Good morning!"))
+            else:  # ordinary chatter, most of which isn't for the bot
+                messages.append(self.message(self.random.choice(CHANNELS), self.random.choice(self.users),
+                                             "[ooc] anyone around?" if roll < 0.6 else "just chatting"))
+        return messages
+
+    def reactions(self) -> list[discord.RawReactionActionEvent]:
+        proxied = list(self.bot.get_cog("Character").message_index.known)
+        events = []
+        for _ in range(self.args.reactions):
+            roll = self.random.random()
+            user = self.random.choice(self.users)
+            message_id = self.random.choice(proxied) if proxied and roll < 0.6 else next(self.fake.ids)
+            emoji = "📋" if roll < 0.4 else "❔" if roll < 0.5 else "✖"
+            payload = discord.RawReactionActionEvent(
+                {"message_id": message_id, "channel_id": self.random.choice(CHANNELS), "user_id": user["id"],
+                 "guild_id": GUILD_ID, "type": 0}, discord.PartialEmoji(name=emoji), "REACTION_ADD")
+            payload.member = self.guild.get_member(user["id"])
+            events.append(payload)
+        return events
+
+    def posts(self) -> list[discord.Message]:
+        state = self.bot._connection
+        posts = []
+        for _ in range(self.args.posts):
+            user = self.random.choice(self.users)
+            thread_id = next(self.fake.ids)
+            self.guild._add_thread(discord.Thread(guild=self.guild, state=state, data={
+                "id": thread_id, "type": 11, "guild_id": GUILD_ID, "parent_id": FORUM_ID, "owner_id": user["id"],
+                "name": "A new character", "message_count": 0, "member_count": 1, "rate_limit_per_user": 0,
+                "thread_metadata": {"archived": False, "auto_archive_duration": 1440,
+                                    "archive_timestamp": timestamp(), "locked": False}}))
+            valid = self.random.random() < 0.9
+            content = "Name: Someone\nRace: Elf\nBackstory: " + "long " * 200 if valid else "forgot the template"
+            attachment = {"id": next(self.fake.ids), "filename": "ref.png", "size": 1024, "url": "https://x/ref.png",
+                          "proxy_url": "https://x/ref.png"}
+            posts.append(discord.Message(state=state, channel=self.guild.get_thread(thread_id), data=message_payload(
+                thread_id, thread_id, user, content, attachments=[attachment])))
+        return posts
+
+    async def drain(self):
+        character = self.bot.get_cog("Character")
+        while character.background or character.outbound.deleting or len(character.outbound):
+            await asyncio.gather(*character.background, *character.outbound.deleting, return_exceptions=True)
+            await asyncio.sleep(0)
+        await self.db.write(lambda c: None)  # everything written before this is committed
+
+    async def replay(self, name: str, events: list, handler):
+        latencies = []
+        errors = 0
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def run(event):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await handler(event)
+                except Exception:
+                    if not errors:
+                        traceback.print_exc()
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        queries, control, rest = self.db.queries, self.db.control, len(self.fake)
+        start = time.perf_counter()
+        await asyncio.gather(*(run(i) for i in events))
+        await self.drain()
+        elapsed = time.perf_counter() - start
+        self.results.append((name, len(events), elapsed, sorted(latencies), self.db.queries - queries,
+                             self.db.control - control, len(self.fake) - rest, errors))
+
+    def report(self):
+        print(f"\n{'stream':<12}{'events':>8}{'events/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'SQL/ev':>8}{'TXN/ev':>8}"
+              f"{'REST/ev':>9}{'errors':>8}")
+        for name, count, elapsed, latencies, queries, control, rest, errors in self.results:
+            if not count:
+                continue
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            print(f"{name:<12}{count:>8}{count / elapsed:>11.0f}{p50:>9.2f}{p99:>9.2f}{queries / count:>8.2f}"
+                  f"{control / count:>8.2f}{rest / count:>9.2f}{errors:>8}")
+        if self.args.metrics:
+            print(f"\n{self.bot.metrics.summary()}")
+        if self.args.routes:
+            print()
+            for route, count in self.fake.calls.most_common():
+                print(f"{count:>8}  {route}")
+
+    async def run(self):
+        try:
+            await self.setup()
+            character = self.bot.get_cog("Character")
+            listeners = self.bot.get_cog("Listeners")
+            await self.replay("messages", self.rp_messages(), character.on_message)
+            await self.replay("reactions", self.reactions(), character.on_raw_reaction_add)
+            await self.replay("posts", self.posts(), listeners.on_message)
+            self.report()
+        finally:
+            await self.bot.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--characters", type=int, default=1000)
+    parser.add_argument("--proxies", type=int, default=100)
+    parser.add_argument("--reminders", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--reactions", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=1, help="events in flight at once")
+    parser.add_argument("--latency", type=float, default=0, help="simulated REST round trip in milliseconds")
+    parser.add_argument("--webhook-rate", type=int, default=10000, help="webhook sends per second per webhook")
+    parser.add_argument("--pool", type=int, default=1, help="webhooks per channel")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--routes", action="store_true", help="print the REST calls made per route")
+    parser.add_argument("--metrics", action="store_true", help="print the bot's own metrics summary")
+    args = parser.parse_args()
+
+    bench = Bench(args)
+    cwd = os.getcwd()
+    os.chdir(bench.directory)  # keeps the images directory the cogs create out of the checkout
+    try:
+        asyncio.run(bench.run())
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(bench.directory, ignore_errors=True)
+
+
+# the template validator's worker processes import this module again
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Streams characters, with their prefixes and proxies, in and out of the database as JSONL or CSV.
+
+The functions take a plain sqlite3 connection so the bot can run them through Database.read/write and the command line
+can run them offline:
+
+    python bulk.py export characters.db out.jsonl [--owner ID]
+    python bulk.py import characters.db in.csv [--owner ID]
+"""
+import argparse
+import csv
+import itertools
+import json
+import sqlite3
+import sys
+from typing import IO, Iterator, NamedTuple, Optional
+
+import migrations
+
+FIELDS = ["id", "name", "pronouns", "race", "classes", "description", "demeanor", "info", "image", "wiki", "owner"]
+BATCH_SIZE = 5000
+
+
+class ImportResult(NamedTuple):
+    characters: int
+    prefixes: int
+    proxies: int
+    skipped: int  # already existed, by (owner, name)
+    images: list[tuple[int, str]]  # (cid, url) still to be downloaded
+
+
+def detect_format(filename: str) -> str:
+    return "csv" if filename.lower().endswith(".csv") else "jsonl"
+
+
+def grouped(cursor: sqlite3.Cursor) -> Iterator[tuple[int, list]]:
+    """Groups rows ordered by their first column, the cid."""
+    for cid, rows in itertools.groupby(cursor, key=lambda row: row[0]):
+        yield cid, list(rows)
+
+
+def read_characters(connection: sqlite3.Connection, owner: Optional[int] = None) -> Iterator[dict]:
+    where, params = ("WHERE owner = ?", (owner,)) if owner is not None else ("", ())
+    characters = connection.execute(f"SELECT {', '.join(FIELDS)} FROM characters {where} ORDER BY id", params)
+    # walked alongside the characters, all three are ordered by cid so nothing has to be held in memory
+    prefixes = grouped(connection.execute("SELECT cid, prefix FROM prefixes ORDER BY cid, id"))
+    proxies = grouped(connection.execute("SELECT cid, user_id, channel, thread FROM proxies ORDER BY cid, id"))
+    next_prefixes, next_proxies = next(prefixes, None), next(proxies, None)
+    for row in characters:
+        character = dict(zip(FIELDS, row))
+        character["prefixes"], character["proxies"] = [], []
+        while next_prefixes is not None and next_prefixes[0] <= character["id"]:
+            if next_prefixes[0] == character["id"]:
+                character["prefixes"] = [i[1] for i in next_prefixes[1]]
+            next_prefixes = next(prefixes, None)
+        while next_proxies is not None and next_proxies[0] <= character["id"]:
+            if next_proxies[0] == character["id"]:
+                character["proxies"] = [{"user_id": i[1], "channel": i[2], "thread": i[3]} for i in next_proxies[1]]
+            next_proxies = next(proxies, None)
+        yield character
+
+
+def export_characters(connection: sqlite3.Connection, file: IO[str], fmt: str = "jsonl",
+                      owner: Optional[int] = None) -> int:
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(file, FIELDS + ["prefixes", "proxies"])
+        writer.writeheader()
+    for character in read_characters(connection, owner):
+        if fmt == "csv":
+            # the nested lists stay JSON inside their cells
+            writer.writerow({**character, "prefixes": json.dumps(character["prefixes"]),
+                             "proxies": json.dumps(character["proxies"])})
+        else:
+            file.write(json.dumps(character, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def parse_characters(file: IO[str], fmt: str = "jsonl") -> Iterator[dict]:
+    if fmt == "csv":
+        for row in csv.DictReader(file):
+            row["prefixes"] = json.loads(row.get("prefixes") or "[]")
+            row["proxies"] = json.loads(row.get("proxies") or "[]")
+            yield row
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def import_characters(connection: sqlite3.Connection, file: IO[str], fmt: str = "jsonl",
+                      owner: Optional[int] = None) -> ImportResult:
+    """Imports every character not already owned under the same name, the caller owns the transaction.
+
+    Ids in the file are not kept, imported characters are numbered after the current highest id."""
+    # plain tuples, the bot's connections return sqlite3.Row which never equals or hashes like one
+    existing = {(row[0], row[1]) for row in connection.execute("SELECT owner, name FROM characters")}
+    next_id = connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM characters").fetchone()[0]
+    counts = {"characters": 0, "prefixes": 0, "proxies": 0, "skipped": 0}
+    images = []
+    rows = parse_characters(file, fmt)
+    for batch in iter(lambda: list(itertools.islice(rows, BATCH_SIZE)), []):
+        characters, prefixes, proxies = [], [], []
+        for character in batch:
+            character_owner = int(owner if owner is not None else character["owner"])
+            if not character.get("name") or (character_owner, character["name"]) in existing:
+                counts["skipped"] += 1
+                continue
+            existing.add((character_owner, character["name"]))
+            cid, next_id = next_id, next_id + 1
+            characters.append((cid, *(character.get(i) or "" for i in FIELDS[1:-1]), character_owner))
+            prefixes.extend((cid, prefix) for prefix in dict.fromkeys(character.get("prefixes") or ()) if prefix)
+            proxies.extend((i["user_id"], cid, i["channel"], i.get("thread") or 0)
+                           for i in character.get("proxies") or ())
+            if character.get("image"):
+                images.append((cid, character["image"]))
+        connection.executemany(f"INSERT INTO characters ({', '.join(FIELDS)}) VALUES "
+                               f"({', '.join('?' * len(FIELDS))})", characters)
+        connection.executemany("INSERT INTO prefixes (cid, prefix) VALUES (?, ?)", prefixes)
+        connection.executemany("INSERT INTO proxies (user_id, cid, channel, thread) VALUES (?, ?, ?, ?)", proxies)
+        counts["characters"] += len(characters)
+        counts["prefixes"] += len(prefixes)
+        counts["proxies"] += len(proxies)
+    return ImportResult(images=images, **counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import or export characters, prefixes and proxies.")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("database")
+    parser.add_argument("file", help="a .csv file, anything else is JSONL; '-' for stdin/stdout")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="overrides the format implied by the file name")
+    parser.add_argument("--owner", type=int, help="only export this user's characters, or import them all as theirs")
+    args = parser.parse_args()
+    fmt = args.format or detect_format(args.file)
+
+    connection = sqlite3.connect(args.database, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("BEGIN IMMEDIATE")
+    migrations.migrate(connection)
+    connection.execute("COMMIT")
+    if args.action == "export":
+        file = sys.stdout if args.file == "-" else open(args.file, "w", newline="", encoding="utf-8")
+        with file:
+            count = export_characters(connection, file, fmt, args.owner)
+        print(f"Exported {count} characters", file=sys.stderr)
+    else:
+        file = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+        with file:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = import_characters(connection, file, fmt, args.owner)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        print(f"Imported {result.characters} characters, {result.prefixes} prefixes and {result.proxies} proxies, "
+              f"skipped {result.skipped} duplicates. Set fetch_missing_images in config.json for the bot to download "
+              f"the {len(result.images)} images on its next start.", file=sys.stderr)
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
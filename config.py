@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import traceback
+from typing import Any, Awaitable, Callable, Optional
+
+Subscriber = Callable[[set[str]], Awaitable[None]]
+MISSING = object()
+
+
+def as_bool(value) -> bool:
+    # write_config stores anything that isn't digits as a string
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+class Config:
+    """config.json, the one copy the whole bot reads from.
+
+    Reads and writes work like the dict it replaces. A write notifies the subscribers of the changed keys and saves the
+    file a moment later off the event loop, so a burst of changes is one write."""
+
+    def __init__(self, path: Optional[str] = "config.json", data: dict = None, debounce: float = 1.0):
+        self.path = path  # None keeps the config in memory only
+        if data is None:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+        self.data: dict[str, Any] = data
+        self.debounce = debounce
+        self.cache: dict[tuple[str, Callable], Any] = {}  # (key, converter) -> converted value
+        self.subscribers: list[tuple[frozenset[str], Subscriber]] = []  # empty keys subscribe to everything
+        self.save_handle: asyncio.TimerHandle = None
+        self.save_lock = asyncio.Lock()
+        self.background: set[asyncio.Task] = set()
+        self.dirty = False
+
+    def __getitem__(self, key: str):
+        return self.data[key]
+
+    def __setitem__(self, key: str, value):
+        self.update({key: value})
+
+    def __contains__(self, key: str):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def typed(self, key: str, convert: Callable, default=None):
+        """The value converted by `convert`, cached until the key changes. Missing keys give `default` as is."""
+        try:
+            return self.cache[key, convert]
+        except KeyError:
+            pass
+        value = self.data.get(key, MISSING)
+        if value is MISSING or value is None:
+            return default
+        value = self.cache[key, convert] = convert(value)
+        return value
+
+    def get_int(self, key: str, default: int = None) -> int:
+        return self.typed(key, int, default)
+
+    def get_float(self, key: str, default: float = None) -> float:
+        return self.typed(key, float, default)
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        return self.typed(key, as_bool, default)
+
+    def get_str(self, key: str, default: str = None) -> str:
+        return self.typed(key, str, default)
+
+    @property
+    def prefix(self) -> str:
+        return self.get_str("prefix", ">")
+
+    def subscribe(self, callback: Subscriber, *keys: str) -> Subscriber:
+        """Awaits callback(changed keys) whenever any of `keys` changes, every change when no keys are given."""
+        self.subscribers.append((frozenset(keys), callback))
+        return callback
+
+    def unsubscribe(self, callback: Subscriber):
+        self.subscribers = [i for i in self.subscribers if i[1] != callback]
+
+    def update(self, values: dict):
+        changed = {key for key, value in values.items() if self.data.get(key, MISSING) != value}
+        if not changed:
+            return
+        self.data.update(values)
+        self.changed(changed)
+        self.schedule_save()
+
+    async def reload(self) -> set[str]:
+        """Rereads the file, returns the keys that changed once their subscribers are done."""
+        if self.path is None:
+            return set()
+        data = await asyncio.get_running_loop().run_in_executor(None, self.read)
+        changed = {key for key in self.data.keys() | data.keys()
+                   if self.data.get(key, MISSING) != data.get(key, MISSING)}
+        self.data = data
+        if changed:
+            await self.changed(changed)
+        return changed
+
+    def changed(self, keys: set[str]) -> asyncio.Task:
+        for key in [i for i in self.cache if i[0] in keys]:
+            del self.cache[key]
+        return self.spawn(self.notify(keys), "Config notifications")
+
+    def spawn(self, coro, name: str) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self.background.add(task)
+        task.add_done_callback(self.background_done)
+        return task
+
+    def background_done(self, task: asyncio.Task):
+        self.background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            traceback.print_exception(task.exception())
+
+    async def notify(self, keys: set[str]):
+        for subscribed, callback in list(self.subscribers):
+            if subscribed and not subscribed & keys:
+                continue
+            try:
+                await callback(keys)
+            except Exception:
+                traceback.print_exc()
+
+    def read(self) -> dict:
+        with open(self.path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def schedule_save(self):
+        if self.path is None:
+            return
+        self.dirty = True
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+        self.save_handle = asyncio.get_running_loop().call_later(
+            self.debounce, lambda: self.spawn(self.save(), "Config save"))
+
+    async def save(self):
+        self.save_handle = None
+        async with self.save_lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            # serialised on the loop so the snapshot is consistent, only the disk work moves off it
+            text = json.dumps(self.data, ensure_ascii=True, indent=2)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.write, text)
+            except OSError:
+                self.dirty = True
+                raise
+        print(f"Saved config to {self.path}")
+
+    def write(self, text: str):
+        # a crash halfway leaves the old file in place instead of a truncated one
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+
+    async def flush(self):
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+        await self.save()
@@ -0,0 +1,163 @@
+import asyncio
+import sqlite3
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, NamedTuple
+
+
+class Result(NamedTuple):
+    lastrowid: int
+    rowcount: int
+    rows: list
+
+
+class Database:
+    def __init__(self, path: str, readers: int = 4, commit_window: float = 0.002, max_batch: int = 256):
+        self.path = path
+        self.reader_count = readers
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self.read_executor = ThreadPoolExecutor(readers, thread_name_prefix="db-read")
+        self.write_executor = ThreadPoolExecutor(1, thread_name_prefix="db-write")
+        self.readers: asyncio.Queue = None
+        self.writer: sqlite3.Connection = None
+        self.queue: asyncio.Queue = None
+        self.writer_task: asyncio.Task = None
+        self.observe: Callable[[str, float], None] = None  # (sql, seconds), called on the database threads
+
+    def open_connection(self, readonly: bool = False) -> sqlite3.Connection:
+        # autocommit mode, the writer manages its own transactions
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        if readonly:
+            connection.execute("PRAGMA query_only=ON")
+        return connection
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        self.writer = await loop.run_in_executor(self.write_executor, self.open_connection)
+        self.readers = asyncio.Queue()
+        for _ in range(self.reader_count):
+            self.readers.put_nowait(await loop.run_in_executor(self.read_executor, self.open_connection, True))
+        self.queue = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self.run_writer(), name="Database writer")
+        self.writer_task.add_done_callback(self.writer_done)
+
+    def writer_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            traceback.print_exception(task.exception())
+        # nothing is left to run these, failing them beats awaiting them forever
+        while not self.queue.empty():
+            job = self.queue.get_nowait()
+            if job is not None and not job[1].done():
+                job[1].set_exception(sqlite3.ProgrammingError("The database writer has stopped"))
+
+    async def close(self):
+        if self.writer_task is None:
+            return
+        self.queue.put_nowait(None)  # everything queued before this still gets written
+        await self.writer_task
+        self.writer_task = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.write_executor, self.writer.close)
+        while not self.readers.empty():
+            await loop.run_in_executor(self.read_executor, self.readers.get_nowait().close)
+
+    async def read(self, fn: Callable[[sqlite3.Connection], Any]):
+        connection = await self.readers.get()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.read_executor, fn, connection)
+        finally:
+            self.readers.put_nowait(connection)
+
+    async def fetchone(self, sql: str, params: Iterable = ()):
+        return await self.read(lambda c: self.timed(sql, lambda: c.execute(sql, params).fetchone()))
+
+    async def fetchall(self, sql: str, params: Iterable = ()):
+        return await self.read(lambda c: self.timed(sql, lambda: c.execute(sql, params).fetchall()))
+
+    async def write(self, fn: Callable[[sqlite3.Connection], Any]):
+        if self.writer_task is None or self.writer_task.done():
+            raise sqlite3.ProgrammingError("The database writer isn't running")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((fn, future))
+        return await future
+
+    async def execute(self, sql: str, params: Iterable = ()) -> Result:
+        return await self.write(lambda c: self.__run(c, sql, params))
+
+    async def executemany(self, sql: str, params: Iterable[Iterable]) -> Result:
+        return await self.write(lambda c: self.__run(c, sql, params, many=True))
+
+    async def transaction(self, statements: list[tuple[str, Iterable]]) -> list[Result]:
+        """Runs every statement atomically, either all of them are committed or none are."""
+        return await self.write(lambda c: [self.__run(c, sql, params) for sql, params in statements])
+
+    def __run(self, connection: sqlite3.Connection, sql: str, params, many: bool = False) -> Result:
+        def run():
+            cursor = connection.executemany(sql, params) if many else connection.execute(sql, params)
+            return Result(cursor.lastrowid, cursor.rowcount, cursor.fetchall())
+        return self.timed(sql, run)
+
+    def timed(self, sql: str, fn: Callable[[], Any]):
+        if self.observe is None:
+            return fn()
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            self.observe(sql, time.perf_counter() - start)
+
+    async def run_writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if batch[0] is not None:
+                # let concurrent writes pile up so they share a single commit
+                await asyncio.sleep(self.commit_window)
+                while len(batch) < self.max_batch and not self.queue.empty() and batch[-1] is not None:
+                    batch.append(self.queue.get_nowait())
+            stop = batch[-1] is None
+            jobs = [i for i in batch if i is not None]
+            if jobs:
+                try:
+                    results = await loop.run_in_executor(self.write_executor, self.run_batch, jobs)
+                except Exception as e:
+                    results = [(False, e)] * len(jobs)
+                for (_, future), (ok, value) in zip(jobs, results):
+                    if future.done():
+                        continue
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+            if stop:
+                return
+
+    def run_batch(self, jobs) -> list[tuple[bool, Any]]:
+        results = []
+        try:
+            # raises "database is locked" once busy_timeout runs out, e.g. while bulk.py imports a file
+            self.writer.execute("BEGIN IMMEDIATE")
+            for fn, _ in jobs:
+                # a failing job only rolls back its own savepoint, not the whole batch
+                self.writer.execute("SAVEPOINT job")
+                try:
+                    value = fn(self.writer)
+                except Exception as e:
+                    self.writer.execute("ROLLBACK TO job")
+                    self.writer.execute("RELEASE job")
+                    results.append((False, e))
+                else:
+                    self.writer.execute("RELEASE job")
+                    results.append((True, value))
+            self.writer.execute("COMMIT")
+        except sqlite3.Error as e:
+            if self.writer.in_transaction:
+                self.writer.execute("ROLLBACK")
+            return [(False, e)] * len(jobs)
+        return results
@@ -1,14 +1,5 @@
-import asyncio
-import json
-import sqlite3
 import sys
 import traceback
-import fastapi
-
-import discord
-
-from CAGBot import DNDBot
-from modules.errorhandler import TracebackHandler
 
 
 def dict_factory(cursor, row):
@@ -18,54 +9,49 @@ def dict_factory(cursor, row):
     return d
 
 
-with open('config.json') as config_file:
-    config = json.load(config_file)
-with open('token.txt', 'r') as token:
-    TOKEN = token.read().rstrip()
-
-
 async def get_prefix(bot_, message):
-    return config["prefix"]
+    return bot_.config.prefix
 
-GUILD_ID = config["server"]
 
-connection = sqlite3.connect(config["database_file"], check_same_thread=False)
-connection.row_factory = sqlite3.Row
+def main():
+    # the template workers (modules/validator.py) are spawned and import this module again, so everything the bot
+    # needs is imported and built in here, where they never get to
+    import discord
 
-db = connection.cursor()
+    from CAGBot import CAGBot
+    from config import Config
+    from database import Database
 
+    config = Config("config.json")
+    with open('token.txt', 'r') as token:
+        token = token.read().rstrip()
 
-intents = discord.Intents.all()
+    db = Database(config["database_file"], readers=config.get_int("database_readers", 4))
 
-bot = DNDBot(db, connection, config, command_prefix=get_prefix, intents=intents, help_command=None)
-DNDBot.instance = bot
+    intents = discord.Intents.all()
 
+    bot = CAGBot(db, config, command_prefix=get_prefix, intents=intents, help_command=None)
+    CAGBot.instance = bot
 
-@bot.event
-async def on_ready():
-    print("Logged in")
-    for i in bot.all_cogs:
-        print("Loading " + i)
-        if i in bot.loaded_cogs: continue
-        await bot.load_extension(i)
-        bot.loaded_cogs.append(i)
-    print("All cogs loaded successfully!")
+    @bot.event
+    async def on_ready():
+        # runs again on every reconnect, cogs are loaded once in CAGBot.setup_hook
+        print("Logged in")
+        bot.milestone("ready")
 
+    @bot.event
+    async def on_error(event, *args, **kwargs):
+        traceback.print_exc()
+        handler, notify = await bot.errors.capture(sys.exc_info()[1], f"event {event}")
+        if not notify:
+            return  # reported recently, the repeats are counted on the error instead
+        channel = bot.get_channel(bot.config["staff_botspam"])
+        repeats = f" ({handler.unreported} repeats since the last report)" if handler.unreported else ""
+        handler.unreported = 0
+        await channel.send(f"An error occurred in {event}. Error code: {str(handler.id)}{repeats}")
 
-@bot.event
-async def on_error(event, *args, **kwargs):
-    exc_type, exc_name, exc_traceback = sys.exc_info()
-    traceback.print_exc()
-    channel = bot.get_channel(config["staff_botspam"])
-    err_code = 255
-    for i in range(len(bot.traceback) + 1):
-        if i in bot.traceback:
-            continue
-        err_code = i
-    original = getattr(exc_traceback, '__cause__', exc_traceback)
-    handler = TracebackHandler(err_code, f"{exc_type.__name__}: {str(exc_name)}", original)
-    bot.traceback[err_code] = handler
-    await channel.send(f"An error occurred in {event}. Error code: {str(err_code)}")
+    bot.run(token)
 
 
-bot.run(TOKEN)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+from discord.http import Route
+from discord.webhook import async_ as webhook_async
+
+# upper bounds in seconds, the last bucket catches everything slower
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SNOWFLAKE = re.compile(r"\d{15,}")
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Interpolated within the bucket the quantile falls in, good enough to tell 2ms from 200ms."""
+        target = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(BUCKETS, self.counts):
+            if count and seen + count >= target:
+                return min(lower + (bound - lower) * (target - seen) / count, self.max)
+            seen += count
+            lower = bound
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        self.handlers: defaultdict[str, Histogram] = defaultdict(Histogram)  # "command x" / "listener Cog.on_x"
+        self.sql: defaultdict[str, Histogram] = defaultdict(Histogram)  # statement -> duration
+        self.rest: defaultdict[str, Histogram] = defaultdict(Histogram)  # "METHOD /route/{template}" -> duration
+        self.rate_limited: Counter[str] = Counter()
+        self.lock = threading.Lock()  # statements are timed on the database threads
+        self.started = time.time()
+
+    def observe_handler(self, name: str, seconds: float):
+        self.handlers[name].observe(seconds)
+
+    def observe_sql(self, sql: str, seconds: float):
+        with self.lock:
+            self.sql[" ".join(sql.split())].observe(seconds)
+
+    def observe_rest(self, route: str, seconds: float):
+        self.rest[route].observe(seconds)
+
+    def summary(self, top: int = 8) -> str:
+        lines = [f"Up {(time.time() - self.started) / 3600:.1f}h"]
+        for title, histograms in (("Handlers", self.handlers), ("SQL", self.sql), ("REST", self.rest)):
+            with self.lock:
+                rows = sorted(histograms.items(), key=lambda i: i[1].sum, reverse=True)
+            lines.append(f"\n{title}: {sum(i.count for _, i in rows)} calls, {sum(i.sum for _, i in rows):.1f}s total")
+            for name, histogram in rows[:top]:
+                lines.append(f"  {histogram.count:>7} {histogram.sum:>8.2f}s"
+                             f"  p50 {histogram.quantile(.5) * 1000:>6.1f}ms"
+                             f"  p99 {histogram.quantile(.99) * 1000:>7.1f}ms  {name[:60]}")
+        if self.rate_limited:
+            lines.append("\n429s: " + ", ".join(f"{route} x{count}" for route, count in
+                                                self.rate_limited.most_common(top)))
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        lines = []
+        for metric, label, histograms in (("cagbot_handler_seconds", "handler", self.handlers),
+                                          ("cagbot_sql_seconds", "statement", self.sql),
+                                          ("cagbot_rest_seconds", "route", self.rest)):
+            lines.append(f"# TYPE {metric} histogram")
+            with self.lock:
+                items = [(name, list(i.counts), i.sum, i.count) for name, i in histograms.items()]
+            for name, counts, total, count in items:
+                name = escape(name)
+                seen = 0
+                for bound, bucket in zip(BUCKETS, counts):
+                    seen += bucket
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {seen}')
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="+Inf"}} {count}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {total}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {count}')
+        lines.append("# TYPE cagbot_rate_limited_total counter")
+        for route, count in self.rate_limited.items():
+            lines.append(f'cagbot_rate_limited_total{{route="{escape(route)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str, port: int) -> web.AppRunner:
+        async def handle(_):
+            return web.Response(text=self.prometheus(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def timed_request(request, metrics: Metrics):
+    """Wraps HTTPClient.request, timing every REST call by its route template."""
+    async def wrapper(route: Route, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await request(route, **kwargs)
+        finally:
+            metrics.observe_rest(route.key, time.perf_counter() - start)
+    return wrapper
+
+
+class TimedWebhookAdapter(webhook_async.AsyncWebhookAdapter):
+    """Webhook requests bypass HTTPClient, so they are timed here."""
+
+    def __init__(self, metrics: Metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    async def request(self, route: Route, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().request(route, *args, **kwargs)
+        finally:
+            self.metrics.observe_rest(route.key, time.perf_counter() - start)
+
+
+class RateLimitHandler(logging.Handler):
+    """discord.py retries 429s internally and only logs them, this counts those log records by route."""
+
+    def __init__(self, metrics: Metrics):
+        super().__init__(logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record: logging.LogRecord):
+        message = str(record.msg)
+        if "responded with 429" in message and len(record.args) >= 2:
+            method, url = record.args[:2]
+            route = f"{method} {SNOWFLAKE.sub('{id}', str(url).removeprefix(Route.BASE))}"
+        elif "Global rate limit" in message:
+            route = "global"
+        elif "Webhook ID" in message and "rate limited" in message:
+            route = "webhook"
+        else:
+            return
+        self.metrics.rate_limited[route] += 1
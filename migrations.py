@@ -0,0 +1,79 @@
+import sqlite3
+
+# Every entry upgrades the schema by one version, the current version is kept in PRAGMA user_version.
+# Never edit a migration that has shipped, append a new one instead.
+MIGRATIONS: list[list[str]] = [
+    # 1: the tables the cogs used to create on load
+    [
+        'CREATE TABLE IF NOT EXISTS "characters" ( "id" INTEGER PRIMARY KEY, "name" TEXT, "pronouns" TEXT, '
+        '"race" TEXT, "classes" TEXT, "description" TEXT, "demeanor" TEXT, "info" TEXT, "image" TEXT, "wiki" TEXT, '
+        '"owner" INTEGER)',
+        "CREATE TABLE IF NOT EXISTS prefixes (id INTEGER PRIMARY KEY, cid INTEGER, prefix TEXT)",
+        "CREATE TABLE IF NOT EXISTS proxies (id INTEGER PRIMARY KEY, user_id INTEGER, cid INTEGER, channel INTEGER, "
+        "thread INTEGER)",
+        "CREATE TABLE IF NOT EXISTS channels (id INTEGER PRIMARY KEY, whitelisted INTEGER, cooldown INTEGER, "
+        "type TEXT)",
+        "CREATE TABLE IF NOT EXISTS reminders (id INTEGER PRIMARY KEY, user_id INTEGER, channel INTEGER, "
+        "time INTEGER, phrase TEXT, jump_url TEXT)",
+        "CREATE TABLE IF NOT EXISTS proxied_messages (message_id INTEGER PRIMARY KEY, cid INTEGER, owner INTEGER, "
+        "webhook_id INTEGER, channel_id INTEGER, thread_id INTEGER)",
+    ],
+    # 2: indexes for the columns the hot paths filter on
+    [
+        "CREATE INDEX IF NOT EXISTS prefixes_cid ON prefixes (cid, prefix)",
+        "CREATE INDEX IF NOT EXISTS prefixes_prefix ON prefixes (prefix, cid)",
+        "CREATE INDEX IF NOT EXISTS characters_owner ON characters (owner, name)",
+        "CREATE INDEX IF NOT EXISTS characters_name ON characters (name)",
+        "CREATE INDEX IF NOT EXISTS proxies_session ON proxies (user_id, channel, thread, cid)",
+        "CREATE INDEX IF NOT EXISTS proxies_cid ON proxies (cid)",
+        "CREATE INDEX IF NOT EXISTS reminders_time ON reminders (time)",
+    ],
+    # 3: per channel webhook pool size, NULL uses the configured default
+    [
+        "ALTER TABLE channels ADD COLUMN webhooks INTEGER",
+    ],
+    # 4: errors that overflowed the in-memory error store
+    [
+        "CREATE TABLE IF NOT EXISTS errors (id INTEGER PRIMARY KEY, fingerprint TEXT, error TEXT, traceback TEXT, "
+        "context TEXT, count INTEGER, first_seen REAL, last_seen REAL)",
+    ],
+    # 5: full text search over characters, kept in sync by triggers
+    [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS characters_fts USING fts5(name, race, classes, description, demeanor, "
+        "content='characters', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        "CREATE TRIGGER IF NOT EXISTS characters_fts_insert AFTER INSERT ON characters BEGIN "
+        "INSERT INTO characters_fts (rowid, name, race, classes, description, demeanor) "
+        "VALUES (new.id, new.name, new.race, new.classes, new.description, new.demeanor); END",
+        "CREATE TRIGGER IF NOT EXISTS characters_fts_delete AFTER DELETE ON characters BEGIN "
+        "INSERT INTO characters_fts (characters_fts, rowid, name, race, classes, description, demeanor) "
+        "VALUES ('delete', old.id, old.name, old.race, old.classes, old.description, old.demeanor); END",
+        "CREATE TRIGGER IF NOT EXISTS characters_fts_update AFTER UPDATE OF name, race, classes, description, demeanor "
+        "ON characters BEGIN "
+        "INSERT INTO characters_fts (characters_fts, rowid, name, race, classes, description, demeanor) "
+        "VALUES ('delete', old.id, old.name, old.race, old.classes, old.description, old.demeanor); "
+        "INSERT INTO characters_fts (rowid, name, race, classes, description, demeanor) "
+        "VALUES (new.id, new.name, new.race, new.classes, new.description, new.demeanor); END",
+        "INSERT INTO characters_fts (characters_fts) VALUES ('rebuild')",
+    ],
+]
+
+
+def schema_version(connection: sqlite3.Connection) -> int:
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection: sqlite3.Connection) -> tuple[int, int]:
+    """Brings the schema up to date and returns the (old, new) versions."""
+    old = version = schema_version(connection)
+    for statements in MIGRATIONS[version:]:
+        for sql in statements:
+            connection.execute(sql)
+        version += 1
+        connection.execute(f"PRAGMA user_version = {version}")
+    if version != old:
+        analyze(connection)
+    return old, version
+
+
+def analyze(connection: sqlite3.Connection):
+    connection.execute("ANALYZE")
@@ -0,0 +1,283 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import discord
+
+_END = None  # trie key holding the prefix rows that end at a node, by cid
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.tries: dict[int, dict] = {}  # owner -> trie root
+        self.owners: dict[int, int] = {}  # cid -> owner
+        self.prefixes: dict[int, set[str]] = {}  # cid -> prefixes
+
+    def __len__(self):
+        return sum(len(i) for i in self.prefixes.values())
+
+    def clear(self):
+        self.tries.clear()
+        self.owners.clear()
+        self.prefixes.clear()
+
+    def load(self, prefixes):
+        self.clear()
+        for prefix in prefixes:
+            self.add(prefix["owner"], prefix)
+
+    def add(self, owner: int, prefix):
+        prefix = {"id": prefix["id"], "cid": prefix["cid"], "prefix": prefix["prefix"]}
+        if not prefix["prefix"]:
+            return
+        self.owners[prefix["cid"]] = owner
+        node = self.tries.setdefault(owner, {})
+        for char in prefix["prefix"]:
+            node = node.setdefault(char, {})
+        # an owner can give the same prefix to several characters, the latest one added wins
+        node.setdefault(_END, {})[prefix["cid"]] = prefix
+        self.prefixes.setdefault(prefix["cid"], set()).add(prefix["prefix"])
+
+    def remove(self, cid: int, prefix: str):
+        owner = self.owners.get(cid)
+        if owner is None or prefix not in self.prefixes.get(cid, ()):
+            return
+        self.prefixes[cid].discard(prefix)
+        root = self.tries.get(owner)
+        path = [root]
+        node = root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return
+            path.append(node)
+        ends = node.get(_END)
+        if ends is not None:
+            ends.pop(cid, None)
+            if not ends:
+                del node[_END]
+        # prune the now empty branch back towards the root
+        for i in range(len(prefix), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][prefix[i - 1]]
+        if not root:
+            del self.tries[owner]
+
+    def remove_character(self, cid: int):
+        for prefix in list(self.prefixes.get(cid, ())):
+            self.remove(cid, prefix)
+        self.prefixes.pop(cid, None)
+        self.owners.pop(cid, None)
+
+    def match(self, owner: int, content: str) -> Optional[dict]:
+        node = self.tries.get(owner)
+        found = None
+        if node is None:
+            return None
+        for char in content:
+            node = node.get(char)
+            if node is None:
+                break
+            if _END in node:
+                found = next(reversed(node[_END].values()))
+        return found
+
+
+class CharacterCache:
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[int, dict] = OrderedDict()
+        self.versions: dict[int, int] = {}  # bumped on every write to a character
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return (f"{len(self.entries)}/{self.maxsize} entries, {self.hits} hits, {self.misses} misses, "
+                f"{self.evictions} evictions")
+
+    def get(self, cid: int) -> Optional[dict]:
+        character = self.entries.get(cid)
+        if character is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(cid)
+        return character
+
+    def version(self, cid: int) -> int:
+        return self.versions.get(cid, 0)
+
+    def put(self, character, version: int = None):
+        # a read that started before a write to this character must not repopulate it
+        if version is not None and version != self.version(character["id"]):
+            return
+        self.entries[character["id"]] = dict(character)
+        self.entries.move_to_end(character["id"])
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def write(self, character):
+        self.versions[character["id"]] = self.version(character["id"]) + 1
+        self.put(character)
+
+    def invalidate(self, cid: int):
+        self.versions[cid] = self.version(cid) + 1
+        self.entries.pop(cid, None)
+
+
+class WebhookCache:
+    def __init__(self):
+        self.webhooks: dict[int, list[discord.Webhook]] = {}  # channel id -> bot owned webhooks
+        self.pending: dict[int, asyncio.Future] = {}
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.webhooks)
+
+    def __str__(self):
+        return (f"{len(self.webhooks)} channels, {sum(map(len, self.webhooks.values()))} webhooks, "
+                f"{self.hits} hits, {self.misses} misses")
+
+    async def get(self, channel_id: int, fetch: Callable[[], Awaitable[list[discord.Webhook]]]):
+        webhooks = self.webhooks.get(channel_id)
+        if webhooks is not None:
+            self.hits += 1
+            return webhooks
+        # concurrent misses for the same channel share a single lookup
+        future = self.pending.get(channel_id)
+        if future is None:
+            self.misses += 1
+            future = self.pending[channel_id] = asyncio.ensure_future(fetch())
+            future.add_done_callback(lambda f: self.__store(channel_id, f))
+        return await asyncio.shield(future)
+
+    def __store(self, channel_id: int, future: asyncio.Future):
+        if self.pending.get(channel_id) is not future:
+            return  # invalidated while the lookup was in flight
+        del self.pending[channel_id]
+        if not future.cancelled() and future.exception() is None and future.result():
+            self.webhooks[channel_id] = future.result()
+
+    def invalidate(self, channel_id: int):
+        self.webhooks.pop(channel_id, None)
+        self.pending.pop(channel_id, None)
+
+
+class CooldownTable:
+    def __init__(self):
+        self.expiries: dict[tuple[int, int], float] = {}  # (cid, channel id) -> monotonic expiry
+        self.sweep_at = 1024
+
+    def __len__(self):
+        return len(self.expiries)
+
+    def set(self, cid: int, channel_id: int, seconds: float):
+        if seconds <= 0:
+            return
+        self.expiries[(cid, channel_id)] = time.monotonic() + seconds
+        if len(self.expiries) >= self.sweep_at:
+            self.sweep()
+            self.sweep_at = max(1024, len(self.expiries) * 2)
+
+    def clear(self, cid: int, channel_id: int):
+        self.expiries.pop((cid, channel_id), None)
+
+    def remaining(self, cid: int, channel_id: int) -> float:
+        expiry = self.expiries.get((cid, channel_id))
+        if expiry is None:
+            return 0
+        remaining = expiry - time.monotonic()
+        if remaining <= 0:
+            del self.expiries[(cid, channel_id)]
+            return 0
+        return remaining
+
+    def sweep(self):
+        now = time.monotonic()
+        self.expiries = {key: expiry for key, expiry in self.expiries.items() if expiry > now}
+
+
+class ChannelPermissions:
+    def __init__(self):
+        self.settings: dict[int, dict] = {}  # channel or category id -> channels row
+        self.resolved: dict[int, Optional[int]] = {}  # channel id -> effective cooldown, None when blocked
+        self.members: dict[int, set[int]] = {}  # category id -> resolved channels inside it
+
+    def load(self, rows):
+        self.settings = {row["id"]: dict(row) for row in rows}
+        self.resolved.clear()
+        self.members.clear()
+
+    def resolve(self, channel_id: int, category_id: Optional[int]) -> Optional[int]:
+        try:
+            return self.resolved[channel_id]
+        except KeyError:
+            pass
+        # an explicit channel setting wins over the category it is in
+        setting = self.settings.get(channel_id)
+        if (setting is None or setting["whitelisted"] is None) and category_id is not None:
+            setting = self.settings.get(category_id)
+        cooldown = setting["cooldown"] if setting is not None and setting["whitelisted"] else None
+        self.resolved[channel_id] = cooldown
+        if category_id is not None:
+            self.members.setdefault(category_id, set()).add(channel_id)
+        return cooldown
+
+    def update(self, row):
+        self.settings.setdefault(row["id"], {}).update(row)
+        self.invalidate(row["id"])
+        for channel_id in self.members.pop(row["id"], ()):
+            self.resolved.pop(channel_id, None)
+
+    def invalidate(self, channel_id: int):
+        self.resolved.pop(channel_id, None)
+
+
+class MessageIndex:
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        # ids of every indexed message, to reject the rest without a query. Roughly 60 bytes each, so ~60MB for a
+        # million messages proxied within message_index_days, Character.prune_messages drops the older ones
+        self.known: set[int] = set()
+        self.entries: OrderedDict[int, dict] = OrderedDict()
+
+    def __len__(self):
+        return len(self.known)
+
+    def __contains__(self, message_id: int):
+        return message_id in self.known
+
+    def load(self, message_ids):
+        self.known = set(message_ids)
+        self.entries.clear()
+
+    def get(self, message_id: int) -> Optional[dict]:
+        entry = self.entries.get(message_id)
+        if entry is not None:
+            self.entries.move_to_end(message_id)
+        return entry
+
+    def put(self, entry):
+        self.entries[entry["message_id"]] = dict(entry)
+        self.entries.move_to_end(entry["message_id"])
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def add(self, entry):
+        self.known.add(entry["message_id"])
+        self.put(entry)
+
+    def remove(self, message_id: int):
+        self.known.discard(message_id)
+        self.entries.pop(message_id, None)
+
+    def prune(self, before: int):
+        """Forgets every message with an id below `before`, ids are snowflakes so that's every older message."""
+        self.known = {i for i in self.known if i >= before}
+        for message_id in [i for i in self.entries if i < before]:
+            del self.entries[message_id]
@@ -1,35 +1,35 @@
 import asyncio
 import datetime
+import io
 import os
+import sqlite3
+import traceback
 from math import ceil
-import aiohttp
+from typing import Optional
 import discord
 from discord.ext import commands
 
+import bulk
 
-class Cooldown:
-    def __init__(self, cid, channel, cooldown):
-        self.cid = cid
-        self.channel = channel
-        self.cooldown = cooldown
+from modules.caches import (ChannelPermissions, CharacterCache, CooldownTable, MessageIndex, PrefixIndex,
+                            WebhookCache)
+from modules.images import ImageDownloader
+from modules.outbound import OutboundQueue
 
-    async def run(self):
-        counter = self.cooldown
-        for i in range(counter):
-            await asyncio.sleep(1)
-            self.cooldown -= 1
+CONTROL_REACTIONS = ["✖", "❔", "📝", "📋"]
+REPLY_PREVIEW_LENGTH = 100
+SEARCH_PAGE_SIZE = 10
+# bm25 weights for name, race, classes, description and demeanor, a name match counts the most
+SEARCH_WEIGHTS = (10.0, 3.0, 3.0, 1.0, 1.0)
+MAX_WEBHOOK_POOL = 10  # discord allows 15 webhooks per channel, leave some for other bots
+CHARACTER_FIELDS = ["id", "name", "pronouns", "race", "classes", "description", "demeanor", "info", "image", "wiki",
+                    "owner"]
 
 
 class Character(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.bot.db.execute(
-            'CREATE TABLE IF NOT EXISTS "characters" ( "id" INTEGER PRIMARY KEY, "name" TEXT, "pronouns" TEXT, "race" TEXT, '
-            '"classes" TEXT, "description" TEXT, "demeanor" TEXT, "info" TEXT, "image" TEXT, "wiki" TEXT, "owner" '
-            'INTEGER)')
-        self.bot.db.execute("CREATE TABLE IF NOT EXISTS prefixes (id INTEGER PRIMARY KEY, cid INTEGER, prefix TEXT)")
-        self.bot.connection.commit()
-        self.api = "https://api.midnight.wtf/images/{}"
+        self.load_config()
         self.help_str = """
 Command Reference
 -----------------
@@ -44,6 +44,7 @@ Character Management:
 
     >list - List all of your characters. This will also show character ids, used in other commands.    
     >view <id> - View a character's information. This will show all information about the character, including the owner and wiki link.
+    >search [page] <terms> - Search every character by name, race, class, description and demeanor. Words can be partial, e.g. ">search elf wiz" finds elf wizards.
     
     >proxy <prefix> - Proxy as a character in the current channel. This will allow you to send messages as the character without needing to use a prefix. Starting a message with '[' will disable proxying for that message.
     >unproxy <prefix> - Unproxy as a character in the current channel. This will disable proxying for the character in the current channel.
@@ -54,7 +55,140 @@ Reactions:
     📋 - View the character's information.
     ❔ - View this help message.
 """
-        self.cooldowns: dict[int, list] = {}
+        self.cooldowns = CooldownTable()
+        self.prefix_index = PrefixIndex()
+        self.character_cache = CharacterCache(self.bot.config.get_int("character_cache_size", 4096))
+        self.webhooks = WebhookCache()
+        self.proxies: dict[tuple[int, int, int], int] = {}  # (user id, channel id, thread id or 0) -> cid
+        self.channel_permissions = ChannelPermissions()
+        self.message_index = MessageIndex(self.bot.config.get_int("message_cache_size", 4096))
+        self.background: set[asyncio.Task] = set()
+        self.warmed = False
+        self.pruner: asyncio.Task = None
+        rate, per = self.bot.config.get("webhook_rate", [5, 2.0])
+        self.outbound = OutboundQueue(self.get_webhooks, rate, per)
+        self.images = ImageDownloader(self.bot,
+                                      max_bytes=self.bot.config.get_int("image_max_bytes", 8 * 1024 * 1024),
+                                      timeout=self.bot.config.get_float("image_timeout", 20),
+                                      concurrency=self.bot.config.get_int("image_concurrency", 4))
+
+    def load_config(self):
+        self.api = self.bot.config.get_str("image_url", "https://api.midnight.wtf/images/{}")
+        self.avatar_api = self.bot.config.get_str("avatar_url", self.api)
+        self.control_reactions = self.bot.config.get("control_reactions", CONTROL_REACTIONS)
+
+    async def on_config_change(self, changed: set[str]):
+        self.load_config()
+        if "webhook_rate" in changed:
+            self.outbound.set_rate(*self.bot.config.get("webhook_rate", [5, 2.0]))
+
+    async def cog_load(self):
+        self.bot.config.subscribe(self.on_config_change, "image_url", "avatar_url", "control_reactions",
+                                  "webhook_rate")
+
+        async def load_channels():
+            self.channel_permissions.load(await self.bot.db.fetchall("SELECT * FROM channels"))
+            self.resolve_channels()
+
+        async def load_message_index():
+            await self.bot.db.execute("DELETE FROM proxied_messages WHERE message_id < ?", (self.message_cutoff(),))
+            self.message_index.load(i["message_id"] for i in
+                                    await self.bot.db.fetchall("SELECT message_id FROM proxied_messages"))
+
+        # independent, the readers run the queries side by side
+        await asyncio.gather(self.load_indexes(), load_channels(), load_message_index())
+        # opt-in, every dead image URL would be requested again on each load
+        if self.bot.config.get_bool("fetch_missing_images", False):
+            self.spawn(self.fetch_missing_images(), "Missing image downloads")
+        self.pruner = asyncio.create_task(self.prune_messages(), name="Proxied message pruning")
+        print(f"Indexed {len(self.prefix_index)} prefixes and {len(self.proxies)} proxies, "
+              f"cached {len(self.character_cache)} characters")
+
+    def message_cutoff(self) -> int:
+        # reactions on proxied messages older than this stop working, keeping the index compact
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            days=self.bot.config.get_float("message_index_days", 90))
+        return discord.utils.time_snowflake(cutoff)
+
+    async def prune_messages(self):
+        # otherwise the index only shrinks when the cog loads, growing by every message proxied in between
+        while True:
+            await asyncio.sleep(self.bot.config.get_float("message_prune_interval", 6 * 3600))
+            cutoff = self.message_cutoff()
+            self.message_index.prune(cutoff)
+            try:
+                await self.bot.db.execute("DELETE FROM proxied_messages WHERE message_id < ?", (cutoff,))
+            except sqlite3.Error:
+                traceback.print_exc()  # the rows are gone from the index either way, the next run retries
+
+    async def load_indexes(self):
+        prefixes, characters, proxies = await asyncio.gather(
+            self.bot.db.fetchall("SELECT prefixes.id, prefixes.cid, prefixes.prefix, characters.owner FROM prefixes "
+                                 "JOIN characters ON characters.id = prefixes.cid"),
+            self.bot.db.fetchall("SELECT * FROM characters WHERE id IN (SELECT cid FROM prefixes) LIMIT ?",
+                                 (self.character_cache.maxsize,)),
+            self.bot.db.fetchall("SELECT user_id, cid, channel, thread FROM proxies"))
+        self.prefix_index.load(prefixes)
+        for character in characters:
+            if character["id"] not in self.character_cache.entries:  # don't clobber fresher cached writes
+                self.character_cache.put(character)
+        self.proxies = {(i["user_id"], i["channel"], i["thread"]): i["cid"] for i in proxies}
+
+    async def fetch_missing_images(self):
+        # characters imported offline, or whose download failed, only have the url
+        present = set(await asyncio.get_running_loop().run_in_executor(None, os.listdir, self.images.directory))
+        characters = await self.bot.db.fetchall("SELECT id, image FROM characters WHERE image IS NOT NULL AND "
+                                                "image != ''")
+        for character in characters:
+            if f"{character['id']}.png" not in present:
+                self.images.schedule(character["id"], character["image"])
+
+    def resolve_channels(self):
+        guild = self.bot.get_guild(self.bot.config.get_int("server"))
+        if guild is None:
+            return  # not connected yet, channels resolve on first use instead
+        for channel in guild.channels:
+            if not isinstance(channel, discord.CategoryChannel):
+                self.channel_permissions.resolve(channel.id, channel.category_id)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # fires again on every reconnect, the caches survive those
+        if self.warmed:
+            return
+        self.warmed = True
+        self.resolve_channels()
+        self.spawn(self.warm_webhooks(), "Webhook warmup")
+
+    async def warm_webhooks(self):
+        # the channels proxied in most recently, so their next message doesn't wait on fetching the webhooks
+        with self.bot.phase("webhook warmup"):
+            rows = await self.bot.db.fetchall("SELECT channel_id FROM proxied_messages GROUP BY channel_id "
+                                              "ORDER BY MAX(message_id) DESC LIMIT ?",
+                                              (self.bot.config.get_int("webhook_warm_channels", 25),))
+            channels = [i for i in (self.bot.get_channel(row["channel_id"]) for row in rows) if i is not None]
+            results = await asyncio.gather(*(self.get_webhooks(i) for i in channels), return_exceptions=True)
+        failed = sum(isinstance(i, Exception) for i in results)
+        print(f"Warmed webhooks for {len(channels) - failed} channels" + (f", {failed} failed" if failed else ""))
+
+    async def cog_unload(self):
+        self.bot.config.unsubscribe(self.on_config_change)
+        if self.pruner is not None:
+            self.pruner.cancel()
+        self.images.cancel_all()
+        await self.outbound.close()
+        for task in list(self.background):
+            task.cancel()
+
+    async def get_character(self, cid: int):
+        character = self.character_cache.get(cid)
+        if character is None:
+            version = self.character_cache.version(cid)
+            character = await self.bot.db.fetchone("SELECT * FROM characters WHERE id = ?", (cid,))
+            if character is not None:
+                character = dict(character)
+                self.character_cache.put(character, version)
+        return character
 
     @commands.command(aliases=['cc', 'create'])
     async def create_character(self, context: commands.Context, name: str = None,
@@ -65,35 +199,33 @@ Reactions:
             info = image + (info if info is not None else "")
             image = context.message.attachments[0].url
 
-        self.bot.db.execute("INSERT INTO characters (name, owner, info, image) VALUES (?, ?, ?, ?)",
-                            (name, context.author.id, info, image))
-        self.bot.connection.commit()
-        cid = self.bot.db.lastrowid
-        await self.update_image(cid, image)
+        result = await self.bot.db.execute("INSERT INTO characters (name, owner, info, image) VALUES (?, ?, ?, ?)",
+                                           (name, context.author.id, info, image))
+        cid = result.lastrowid
+        self.character_cache.write({**dict.fromkeys(CHARACTER_FIELDS), "id": cid, "name": name,
+                                    "owner": context.author.id, "info": info, "image": image})
+        self.images.schedule(cid, image)
         await context.send("Character created!")
 
     async def create_char_dynamic(self, context: commands.Context):
         try:
-            await context.send("Enter character name:")
-            name_message = await self.bot.wait_for("message", check=lambda m: m.author == context.author, timeout=120)
-            await context.send("Enter character pronouns:")
-            pronouns_message = await self.bot.wait_for("message", check=lambda m: m.author == context.author,
-                                                       timeout=120)
-            await context.send("Enter character race")
-            race_message = await self.bot.wait_for("message", check=lambda m: m.author == context.author, timeout=120)
-            await context.send("Enter character class(es):")
-            classes_message = await self.bot.wait_for("message", check=lambda m: m.author == context.author,
-                                                      timeout=120)
-            await context.send("Enter character physical appearance:")
-            description_message = await self.bot.wait_for("message", check=lambda m: m.author == context.author,
-                                                          timeout=120)
-            await context.send("Enter character demeanor:")
-            demeanor_message = await self.bot.wait_for("message", check=lambda m: m.author == context.author,
-                                                       timeout=120)
-            await context.send("Enter character image:")
-            image_message = await self.bot.wait_for("message", check=lambda m: m.author == context.author, timeout=120)
-            await context.send("Enter character wiki link (enter 'none' to skip):")
-            wiki_message = await self.bot.wait_for("message", check=lambda m: m.author == context.author, timeout=120)
+            with self.bot.conversations.open(context.channel.id, context.author.id) as conversation:
+                await context.send("Enter character name:")
+                name_message = await conversation.answer()
+                await context.send("Enter character pronouns:")
+                pronouns_message = await conversation.answer()
+                await context.send("Enter character race")
+                race_message = await conversation.answer()
+                await context.send("Enter character class(es):")
+                classes_message = await conversation.answer()
+                await context.send("Enter character physical appearance:")
+                description_message = await conversation.answer()
+                await context.send("Enter character demeanor:")
+                demeanor_message = await conversation.answer()
+                await context.send("Enter character image:")
+                image_message = await conversation.answer()
+                await context.send("Enter character wiki link (enter 'none' to skip):")
+                wiki_message = await conversation.answer()
         except asyncio.TimeoutError:
             await context.send("Timed out!")
             return
@@ -116,10 +248,10 @@ Reactions:
         # info = info_message.content
         wiki = wiki_message.content
 
-        self.bot.db.execute("INSERT INTO characters (name, pronouns, race, classes, description, demeanor, owner, "
-                            "info, image, wiki) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                            (name, pronouns, race, classes, description, demeanor, context.author.id, "", image, wiki))
-        self.bot.connection.commit()
+        result = await self.bot.db.execute(
+            "INSERT INTO characters (name, pronouns, race, classes, description, demeanor, owner, info, image, wiki) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, pronouns, race, classes, description, demeanor, context.author.id, "", image, wiki))
         embed = discord.Embed(
             title=f"Character Created",
             description=f"Name: {name}",
@@ -127,8 +259,11 @@ Reactions:
             timestamp=datetime.datetime.utcnow()
         )
         embed.set_image(url=image)
-        cid = self.bot.db.lastrowid
-        await self.update_image(cid, image)
+        cid = result.lastrowid
+        self.character_cache.write({"id": cid, "name": name, "pronouns": pronouns, "race": race, "classes": classes,
+                                    "description": description, "demeanor": demeanor, "info": "", "image": image,
+                                    "wiki": wiki, "owner": context.author.id})
+        self.images.schedule(cid, image)
 
         await context.send(embed=embed)
         await context.send(f"Character created with character id {cid}, run `>add_prefix` to add a prefix to "
@@ -136,16 +271,21 @@ Reactions:
 
     @commands.command(aliases=['dc', 'delete'])
     async def delete_character(self, context: commands.Context, cid: int):
-        character = self.bot.db.execute("SELECT * FROM characters WHERE id = ?", (cid,)).fetchone()
+        character = await self.get_character(cid)
         if character["owner"] != context.author.id:
             await context.send("You do not own this character!")
             return
-        self.bot.db.execute("DELETE FROM characters WHERE id = ?", (cid,))
-        self.bot.db.execute("DELETE FROM prefixes WHERE cid = ?", (cid,))
-        self.bot.connection.commit()
-        path = f"images/{cid}.png"
+        await self.bot.db.transaction([("DELETE FROM characters WHERE id = ?", (cid,)),
+                                       ("DELETE FROM prefixes WHERE cid = ?", (cid,)),
+                                       ("DELETE FROM proxies WHERE cid = ?", (cid,))])
+        self.prefix_index.remove_character(cid)
+        self.proxies = {key: value for key, value in self.proxies.items() if value != cid}
+        self.character_cache.invalidate(cid)
+        self.images.cancel(cid)
+        path = self.images.path(cid)
         if os.path.exists(path):
             os.remove(path)
+        self.bot.dispatch("character_image_deleted", cid)
         await context.send("Character deleted!")
 
     @commands.command(aliases=['ec', 'edit'])
@@ -157,21 +297,21 @@ Reactions:
         if field not in fields:
             await context.send(f"Available fields: {', '.join(fields)}")
             return
-        if field == "image":
-            if len(context.message.attachments) > 0:
-                value = context.message.attachments[0].url
-            await self.update_image(cid, value)
-        character = self.bot.db.execute("SELECT * FROM characters WHERE id = ?", (cid,)).fetchone()
+        character = await self.get_character(cid)
         if character["owner"] != context.author.id:
             await context.send("You do not own this character!")
             return
-        self.bot.db.execute(f"UPDATE characters SET {field} = ? WHERE id = ?", (value, cid))
-        self.bot.connection.commit()
+        if field == "image":
+            if len(context.message.attachments) > 0:
+                value = context.message.attachments[0].url
+            self.images.schedule(cid, value)
+        await self.bot.db.execute(f"UPDATE characters SET {field} = ? WHERE id = ?", (value, cid))
+        self.character_cache.write({**character, field: value})
         await context.send("Character updated!")
 
     @commands.command(aliases=['view'])
     async def view_character(self, context: commands.Context, cid: int):
-        character = self.bot.db.execute("SELECT * FROM characters WHERE id = ?", (cid,)).fetchone()
+        character = await self.get_character(cid)
         if character is None:
             await context.send("Character not found!")
             return
@@ -179,9 +319,39 @@ Reactions:
 
         await context.send(embed=embed)
 
+    @commands.command(aliases=['find'])
+    async def search(self, context: commands.Context, page: Optional[int] = 1, *, terms: str):
+        # every word becomes a quoted prefix term so user input can't produce an FTS5 syntax error
+        query = " ".join('"' + word.replace('"', '""') + '"*' for word in terms.split())
+        page = max(page, 1)
+
+        def run(connection):
+            total = connection.execute("SELECT count(*) FROM characters_fts WHERE characters_fts MATCH ?",
+                                       (query,)).fetchone()[0]
+            rows = connection.execute(
+                "SELECT characters.id, characters.name, characters.race, characters.classes, characters.owner "
+                "FROM characters_fts JOIN characters ON characters.id = characters_fts.rowid "
+                f"WHERE characters_fts MATCH ? ORDER BY bm25(characters_fts, {', '.join(map(str, SEARCH_WEIGHTS))}) "
+                "LIMIT ? OFFSET ?", (query, SEARCH_PAGE_SIZE, (page - 1) * SEARCH_PAGE_SIZE)).fetchall()
+            return total, rows
+
+        total, rows = await self.bot.db.read(run)
+        if not rows:
+            await context.send("No characters found!" if total == 0 else f"There are only "
+                               f"{ceil(total / SEARCH_PAGE_SIZE)} pages of results!")
+            return
+        embed = discord.Embed(title=f"Characters matching {terms}"[:256], color=discord.Color.gold())
+        for row in rows:
+            details = " ".join(i for i in (row["race"], row["classes"]) if i)
+            embed.add_field(name=row["name"] or "Unnamed",
+                            value=f"ID: {row['id']}" + (f" | {details}" if details else "") + f" | <@{row['owner']}>",
+                            inline=False)
+        embed.set_footer(text=f"Page {page} of {ceil(total / SEARCH_PAGE_SIZE)}, {total} results")
+        await context.send(embed=embed)
+
     @commands.command(aliases=['lc', 'list'])
     async def list_characters(self, context: commands.Context):
-        chars = self.bot.db.execute("SELECT * FROM characters WHERE owner = ?", (context.author.id,)).fetchall()
+        chars = await self.bot.db.fetchall("SELECT * FROM characters WHERE owner = ?", (context.author.id,))
 
         if len(chars) == 0:
             await context.send("You have no characters!")
@@ -209,59 +379,105 @@ Reactions:
             return await self.add_prefix_dynamic(context)
         if prefix is None:
             return await self.add_prefix_dynamic(context, cid)
-        character = self.bot.db.execute("SELECT * FROM characters WHERE id = ?", (cid,)).fetchone()
+        character = await self.get_character(cid)
         if character["owner"] != context.author.id:
             await context.send("You do not own this character!")
             return
-        self.bot.db.execute("INSERT INTO prefixes (cid, prefix) VALUES (?, ?)", (cid, prefix))
-        self.bot.connection.commit()
+        await self.__insert_prefix(character, prefix)
         await context.send("Prefix added!")
 
     async def add_prefix_dynamic(self, context, cid: int = None):
-        prefix = self.__fetch_prefix(context, cid)
-        self.bot.db.execute("INSERT INTO prefixes (cid, prefix) VALUES (?, ?)", (cid, prefix))
-        self.bot.connection.commit()
+        character, prefix = await self.__fetch_prefix(context, cid)
+        if prefix is None:
+            return
+        await self.__insert_prefix(character, prefix)
         await context.send("Prefix added!")
 
+    async def __insert_prefix(self, character, prefix: str):
+        result = await self.bot.db.execute("INSERT INTO prefixes (cid, prefix) VALUES (?, ?)", (character["id"], prefix))
+        self.prefix_index.add(character["owner"], {"id": result.lastrowid, "cid": character["id"], "prefix": prefix})
+
     @commands.command(aliases=['rp', 'dp', 'delete_prefix'])
     async def remove_prefix(self, context: commands.Context, cid: int = None, prefix: str = None):
         if cid is None:
             return await self.remove_prefix_dynamic(context)
         if prefix is None:
             return await self.remove_prefix_dynamic(context, cid)
-        character = self.bot.db.execute("SELECT * FROM characters WHERE id = ?", (cid,)).fetchone()
+        character = await self.get_character(cid)
         if character["owner"] != context.author.id:
             await context.send("You do not own this character!")
             return
-        self.bot.db.execute("DELETE FROM prefixes WHERE cid = ? AND prefix = ?", (cid, prefix))
-        self.bot.connection.commit()
+        await self.__delete_prefix(cid, prefix)
         await context.send("Prefix removed!")
 
     async def remove_prefix_dynamic(self, context, cid: int = None):
-        prefix = await self.__fetch_prefix(context, cid)
+        character, prefix = await self.__fetch_prefix(context, cid)
         if prefix is None:
             return
-        self.bot.db.execute("DELETE FROM prefixes WHERE cid = ? AND prefix = ?", (cid, prefix))
-        self.bot.connection.commit()
+        await self.__delete_prefix(character["id"], prefix)
         await context.send("Prefix removed!")
 
+    async def __delete_prefix(self, cid: int, prefix: str):
+        await self.bot.db.execute("DELETE FROM prefixes WHERE cid = ? AND prefix = ?", (cid, prefix))
+        self.prefix_index.remove(cid, prefix)
+
     async def __fetch_prefix(self, context: commands.Context, cid: int = None):
         try:
-            if cid is None:
-                await context.send("Enter character id:")
-                cid_message = await self.bot.wait_for("message", check=lambda m: m.author == context.author,
-                                                      timeout=120)
-                cid = int(cid_message.content)
-                character = self.bot.db.execute("SELECT * FROM characters WHERE id = ?", (cid,)).fetchone()
-                if character["owner"] != context.author.id:
+            with self.bot.conversations.open(context.channel.id, context.author.id) as conversation:
+                if cid is None:
+                    await context.send("Enter character id:")
+                    cid = int((await conversation.answer()).content)
+                character = await self.get_character(cid)
+                if character is None or character["owner"] != context.author.id:
                     await context.send("You do not own this character!")
-                    return None
-            await context.send("Enter prefix:")
-            prefix_message = await self.bot.wait_for("message", check=lambda m: m.author == context.author, timeout=120)
-            return prefix_message.content
+                    return None, None
+                await context.send("Enter prefix:")
+                return character, (await conversation.answer()).content
         except asyncio.TimeoutError:
             await context.send("Timed out!")
-            return None
+            return None, None
+        except ValueError:
+            await context.send("Invalid character id!")
+            return None, None
+
+    @commands.command()
+    @commands.is_owner()
+    async def export_characters(self, context: commands.Context, fmt: str = "jsonl", owner: discord.User = None):
+        if fmt not in ("jsonl", "csv"):
+            await context.send("Format must be jsonl or csv!")
+            return
+        file = io.BytesIO()
+        text = io.TextIOWrapper(file, encoding="utf-8", newline="")
+        count = await self.bot.db.read(lambda c: bulk.export_characters(c, text, fmt, owner.id if owner else None))
+        text.flush()
+        file.seek(0)
+        await context.send(f"Exported {count} characters!", file=discord.File(file, filename=f"characters.{fmt}"))
+
+    @commands.command()
+    @commands.is_owner()
+    async def import_characters(self, context: commands.Context, owner: discord.User = None):
+        if not context.message.attachments:
+            await context.send("Attach a .jsonl or .csv file to import!")
+            return
+        attachment = context.message.attachments[0]
+        text = io.TextIOWrapper(io.BytesIO(await attachment.read()), encoding="utf-8", newline="")
+        # one transaction for the whole file, either everything is imported or nothing is
+        result = await self.bot.db.write(lambda c: bulk.import_characters(
+            c, text, bulk.detect_format(attachment.filename), owner.id if owner else None))
+        await self.load_indexes()
+        for cid, url in result.images:
+            self.images.schedule(cid, url)
+        await context.send(f"Imported {result.characters} characters, {result.prefixes} prefixes and "
+                           f"{result.proxies} proxies, skipped {result.skipped} duplicates. Downloading "
+                           f"{len(result.images)} images in the background.")
+
+    @commands.command()
+    @commands.is_owner()
+    async def cache_stats(self, context: commands.Context):
+        await context.send(f"Characters: {self.character_cache}\nPrefixes: {len(self.prefix_index)} indexed\n"
+                           f"Webhooks: {self.webhooks}\nCooldowns: {len(self.cooldowns)} active\n"
+                           f"Proxies: {len(self.proxies)} active\nProxied messages: {len(self.message_index)} indexed\n"
+                           f"Outbound: {self.outbound}\nPrompts: {self.bot.conversations}")
 
     @commands.command()
     async def help(self, context: commands.Context):
@@ -269,73 +485,91 @@ Reactions:
 
     @commands.command(aliases=["allow_channel"])
     async def whitelist_channel(self, context: commands.Context, channel: discord.TextChannel, cooldown: int = 0):
-        info = self.bot.db.execute("SELECT * FROM channels WHERE id = ?", (channel.id,)).fetchone()
-        if info is None:
-            self.bot.db.execute("INSERT INTO channels (id, whitelisted, cooldown, type) VALUES (?, ?, ?, ?)",
-                                (channel.id, 1, cooldown, "text"))
-            info = self.bot.db.execute("SELECT * FROM channels WHERE id = ?", (channel.id,)).fetchone()
-        elif info["whitelisted"] == 1:
+        info = self.channel_permissions.settings.get(channel.id)
+        if info is not None and info["whitelisted"] == 1 and info["cooldown"] == cooldown:
             await context.send("Channel already whitelisted!")
             return
-        elif info["whitelisted"] == 0:
-            self.bot.db.execute("UPDATE channels SET whitelisted = ?, cooldown = ? WHERE id = ?", (1, cooldown, channel.id))
-        self.bot.connection.commit()
+        await self.__update_channel(channel.id, 1, cooldown, "text")
         await context.send("Channel whitelisted!")
 
     @commands.command(aliases=["deny_channel"])
     async def blacklist_channel(self, context: commands.Context, channel: discord.TextChannel):
-        info = self.bot.db.execute("SELECT * FROM channels WHERE id = ?", (channel.id,)).fetchone()
-        if info is None:
-            self.bot.db.execute("INSERT INTO channels (id, whitelisted, cooldown, type) VALUES (?, ?, ?, ?)",
-                                (channel.id, 0, 0, "text"))
-        if info["whitelisted"] == 0:
+        info = self.channel_permissions.settings.get(channel.id)
+        if info is not None and info["whitelisted"] == 0:
             await context.send("Channel already blacklisted!")
             return
-        else:
-            self.bot.db.execute("UPDATE channels SET whitelisted = ?, cooldown = ? WHERE id = ?", (0, 0, channel.id))
-        self.bot.connection.commit()
+        await self.__update_channel(channel.id, 0, 0, "text")
         await context.send("Channel blacklisted!")
 
     @commands.command(aliases=["allow_category"])
     async def whitelist_category(self, context: commands.Context, category: discord.CategoryChannel):
-        info = self.bot.db.execute("SELECT * FROM channels WHERE id = ?", (category.id,)).fetchone()
-        if info is None:
-            self.bot.db.execute("INSERT INTO channels (id, whitelisted, cooldown, type) VALUES (?, ?, ?, ?)",
-                                (category.id, 1, 0, "category"))
-        if info["whitelisted"] == 1:
+        info = self.channel_permissions.settings.get(category.id)
+        if info is not None and info["whitelisted"] == 1:
             await context.send("Category already whitelisted!")
             return
-        else:
-            self.bot.db.execute("UPDATE channels SET whitelisted = ?, cooldown = ? WHERE id = ?", (1, 0, category.id))
-        self.bot.connection.commit()
+        await self.__update_channel(category.id, 1, 0, "category")
         await context.send("Category whitelisted!")
 
     @commands.command(aliases=["deny_category"])
     async def blacklist_category(self, context: commands.Context, category: discord.CategoryChannel):
-        info = self.bot.db.execute("SELECT * FROM channels WHERE id = ?", (category.id,)).fetchone()
-        if info is None:
-            self.bot.db.execute("INSERT INTO channels (id, whitelisted, cooldown, type) VALUES (?, ?, ?, ?)",
-                                (category.id, 0, 0, "category"))
-        if info["whitelisted"] == 0:
+        info = self.channel_permissions.settings.get(category.id)
+        if info is not None and info["whitelisted"] == 0:
             await context.send("Category already blacklisted!")
             return
-        else:
-            self.bot.db.execute("UPDATE channels SET whitelisted = ?, cooldown = ? WHERE id = ?", (0, 0, category.id))
-        self.bot.connection.commit()
+        await self.__update_channel(category.id, 0, 0, "category")
         await context.send("Category blacklisted!")
 
+    async def __update_channel(self, channel_id: int, whitelisted: int, cooldown: int, _type: str):
+        if channel_id in self.channel_permissions.settings:
+            await self.bot.db.execute("UPDATE channels SET whitelisted = ?, cooldown = ? WHERE id = ?",
+                                      (whitelisted, cooldown, channel_id))
+        else:
+            await self.bot.db.execute("INSERT INTO channels (id, whitelisted, cooldown, type) VALUES (?, ?, ?, ?)",
+                                      (channel_id, whitelisted, cooldown, _type))
+        self.channel_permissions.update({"id": channel_id, "whitelisted": whitelisted, "cooldown": cooldown,
+                                         "type": _type})
+
+    @commands.command()
+    @commands.has_permissions(manage_webhooks=True)
+    async def webhook_pool(self, context: commands.Context, channel: discord.TextChannel, size: int):
+        if not 1 <= size <= MAX_WEBHOOK_POOL:
+            await context.send(f"Pool size must be between 1 and {MAX_WEBHOOK_POOL}!")
+            return
+        if channel.id in self.channel_permissions.settings:
+            await self.bot.db.execute("UPDATE channels SET webhooks = ? WHERE id = ?", (size, channel.id))
+            self.channel_permissions.update({"id": channel.id, "webhooks": size})
+        else:
+            # whitelisted stays NULL so the channel keeps inheriting its category's settings
+            await self.bot.db.execute("INSERT INTO channels (id, cooldown, type, webhooks) VALUES (?, 0, 'text', ?)",
+                                      (channel.id, size))
+            self.channel_permissions.update({"id": channel.id, "whitelisted": None, "cooldown": 0, "type": "text",
+                                             "webhooks": size})
+        self.webhooks.invalidate(channel.id)
+        await context.send(f"Proxied messages in {channel.mention} now use {size} webhook{'s' * (size != 1)}!")
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        if getattr(before, "category_id", None) != getattr(after, "category_id", None):
+            self.channel_permissions.invalidate(after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self.channel_permissions.invalidate(channel.id)
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        if message.author.bot or message.guild is None or message.content[0] == '[' or message.content[0] == self.bot.config["prefix"]:
+        if message.author.bot or message.guild is None or not message.content or message.content[0] == '[' or message.content.startswith(self.bot.config.prefix):
             return
+        if self.bot.conversations.is_claimed(message):
+            return  # an answer to one of the bot's prompts
         if isinstance(message.channel, discord.Thread):
             channel = message.channel.parent
         else:
             channel = message.channel
 
-        char = self.handle_proxied_message(message)
+        char = await self.handle_proxied_message(message)
         if char is None:
-            char, found_prefix = self.fetch_char_info(message.content, message.author.id)
+            char, found_prefix = await self.fetch_char_info(message.content, message.author.id)
             if char is None or found_prefix is None:
                 return
             full_message = message.content[len(found_prefix['prefix']):]
@@ -344,74 +578,71 @@ Reactions:
 
         if len(full_message) == 0:
             await message.delete()
+            return
 
-        if cooldown := self.get_channel_cooldown(channel.id, channel.category_id) is None:
+        if (cooldown := self.get_channel_cooldown(channel.id, channel.category_id)) is None:
             return  # channel is blacklisted
-        if self.get_character_cooldown(char["id"], message.channel):
+        if remaining := self.cooldowns.remaining(char["id"], message.channel.id):
             await message.delete()
-            await message.channel.send(f"This character is on cooldown! Please wait {cooldown} seconds")
-
+            await message.channel.send(f"This character is on cooldown! Please wait {ceil(remaining)} seconds")
+            return
 
-        webhook = await self.create_webhook(channel)
-        await self.send_message(webhook, message, char, full_message)
-        await self.set_cooldown(cooldown, message.channel, char["id"])
+        # reserved before queueing, the send can wait behind a burst and the next message has to see the cooldown
+        self.cooldowns.set(char["id"], message.channel.id, cooldown)
+        try:
+            await self.send_message(channel, message, char, full_message)
+        except Exception:
+            self.cooldowns.clear(char["id"], message.channel.id)
+            raise
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
-        if payload.user_id == self.bot.user.id:
-            return
-
-        channel = self.bot.get_channel(payload.channel_id)
-        if isinstance(channel, discord.Thread):
-            true_channel = channel.parent
-            thread = True
-        else:
-            true_channel = channel
-            thread = False
-        if channel.guild is None:
-            return
-
-        webhook = None
-        for i in await true_channel.webhooks():
-            if i.user.id == self.bot.user.id:
-                webhook = i
-                break
-        try:
-            message = await webhook.fetch_message(payload.message_id, thread=channel if thread else discord.utils.MISSING)
-        except (discord.NotFound, AttributeError):
+        if payload.emoji.name not in CONTROL_REACTIONS or payload.user_id == self.bot.user.id:
             return
-        if message.webhook_id != webhook.id:
+        if payload.message_id not in self.message_index:
+            return  # not a proxied message
+        proxied = await self.get_proxied_message(payload.message_id)
+        if proxied is None:
             return
-        message: discord.WebhookMessage
 
-        character = self.bot.db.execute("SELECT * FROM characters WHERE name = ?",
-                                        (message.author.display_name,)).fetchone()
-        if character is None:
-            return
+        channel = self.bot.get_channel(payload.channel_id) or self.bot.get_partial_messageable(
+            payload.channel_id, guild_id=payload.guild_id)
+        message = channel.get_partial_message(payload.message_id)
+        character = await self.get_character(proxied["cid"])
+        owner = character["owner"] if character is not None else proxied["owner"]
         if payload.emoji.name == "✖":
-            if not payload.user_id == character["owner"]:
+            if not payload.user_id == owner:
                 await message.remove_reaction(payload.emoji, payload.member)
                 return
             await message.delete()
+            await self.forget_message(payload.message_id)
             return
         elif payload.emoji.name == "📝":
-            if not payload.user_id == character["owner"]:
+            if not payload.user_id == owner:
                 await message.remove_reaction(payload.emoji, payload.member)
                 return
-            to_delete = await message.channel.send("Enter new message content:")
-            try:
-                msg = await self.bot.wait_for("message", check=lambda m: m.author == payload.member, timeout=120)
-                await message.edit(content=msg.content)
-                await msg.delete()
-            except asyncio.TimeoutError:
-                await message.channel.send("Timed out!")
-            finally:
-                await to_delete.delete()
+            webhook = await self.get_message_webhook(proxied)
+            if webhook is None:
                 await message.remove_reaction(payload.emoji, payload.member)
+                return
+            with self.bot.conversations.open(payload.channel_id, payload.user_id) as conversation:
+                to_delete = await channel.send("Enter new message content:")
+                try:
+                    msg = await conversation.answer()
+                    await webhook.edit_message(payload.message_id, content=msg.content,
+                                               thread=discord.Object(proxied["thread_id"]) if proxied["thread_id"]
+                                               else discord.utils.MISSING)
+                    await msg.delete()
+                except asyncio.TimeoutError:
+                    await channel.send("Timed out!")
+                finally:
+                    await to_delete.delete()
+                    await message.remove_reaction(payload.emoji, payload.member)
 
         elif payload.emoji.name == "📋":
+            if character is None:
+                return
             member = self.bot.get_user(payload.user_id)
-            await message.remove_reaction(payload.emoji, member)
             embed = self.__generate_character_embed(character)
             await member.send(embed=embed)
             await message.remove_reaction(payload.emoji, payload.member)
@@ -422,29 +653,55 @@ Reactions:
 
             await message.remove_reaction(payload.emoji, payload.member)
 
-    def fetch_char_info(self, content, author):
-        prefixes = self.bot.db.execute("SELECT * FROM prefixes").fetchall()
-        found_prefix = None
-        found_prefixes = [i for i in prefixes if content.startswith(i["prefix"])]
-        char = None
-        for prefix in found_prefixes:
-            potential_cid = prefix["cid"]
-            tmp = self.bot.db.execute("SELECT * FROM characters WHERE id = ?", (potential_cid,)).fetchone()
-            if tmp["owner"] != author:
-                continue
-            else:
-                found_prefix = prefix
-                char = tmp
-        return char, found_prefix
+    async def get_proxied_message(self, message_id: int):
+        proxied = self.message_index.get(message_id)
+        if proxied is None:
+            proxied = await self.bot.db.fetchone("SELECT * FROM proxied_messages WHERE message_id = ?", (message_id,))
+            if proxied is None:
+                self.message_index.remove(message_id)
+                return None
+            self.message_index.put(proxied)
+        return proxied
+
+    async def index_message(self, message: discord.WebhookMessage, char: dict):
+        proxied = {"message_id": message.id, "cid": char["id"], "owner": char["owner"],
+                   "webhook_id": message.webhook_id, "channel_id": message.channel.id,
+                   "thread_id": message.channel.id if isinstance(message.channel, discord.Thread) else 0}
+        if proxied["thread_id"]:
+            proxied["channel_id"] = message.channel.parent_id
+        self.message_index.add(proxied)
+        await self.bot.db.execute(
+            "INSERT OR REPLACE INTO proxied_messages (message_id, cid, owner, webhook_id, channel_id, thread_id) "
+            "VALUES (:message_id, :cid, :owner, :webhook_id, :channel_id, :thread_id)", proxied)
+
+    async def forget_message(self, message_id: int):
+        if message_id not in self.message_index:
+            return
+        self.message_index.remove(message_id)
+        await self.bot.db.execute("DELETE FROM proxied_messages WHERE message_id = ?", (message_id,))
 
-    @staticmethod
-    async def update_image(cid, image):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(image) as resp:
-                if resp.status != 200:
-                    return False
-                with open(f"images/{cid}.png", "wb") as f:
-                    f.write(await resp.read())
+    async def get_message_webhook(self, proxied):
+        channel = self.bot.get_channel(proxied["channel_id"])
+        if channel is None:
+            return None
+        # any of the channel's webhooks may have sent it, including ones left over from a larger pool
+        webhooks = await self.webhooks.get(channel.id, lambda: self.fetch_webhooks(channel))
+        return discord.utils.get(webhooks, id=proxied["webhook_id"])
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        await self.forget_message(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        for message_id in payload.message_ids:
+            await self.forget_message(message_id)
+
+    async def fetch_char_info(self, content, author):
+        found_prefix = self.prefix_index.match(author, content)
+        if found_prefix is None:
+            return None, None
+        return await self.get_character(found_prefix["cid"]), found_prefix
 
     def __generate_character_embed(self, character):
         embed = discord.Embed(
@@ -464,129 +721,136 @@ Reactions:
 
     @commands.command()
     async def proxy(self, context: commands.Context, prefix: str):
-        char, found_prefix = self.fetch_char_info(prefix, context.author.id)
+        char, found_prefix = await self.fetch_char_info(prefix, context.author.id)
         if char is None or found_prefix is None:
             to_delete = await context.send("Character not found!")
             await asyncio.sleep(3)
             await to_delete.delete()
             return
-        channel = context.channel.id
-        thread = 0
-        if isinstance(context.channel, discord.Thread):
-            channel = context.channel.parent.id
-            thread = context.channel.id
-
-        resp = self.bot.db.execute("SELECT * FROM proxies WHERE user_id = ? AND channel = ? AND thread = ?", (context.author.id, channel, thread)).fetchone()
-        if resp is not None:
+        key = self.proxy_key(context.author.id, context.channel)
+        if key in self.proxies:
             to_delete = await context.send("You are already proxied in this channel!")
             await asyncio.sleep(3)
             await to_delete.delete()
+            return
 
-        self.bot.db.execute("INSERT INTO proxies (user_id, cid, channel, thread) VALUES (?, ?, ?, ?)", (context.author.id, char['id'], channel, thread))
-        self.bot.connection.commit()
+        self.proxies[key] = char["id"]
+        try:
+            await self.bot.db.execute("INSERT INTO proxies (user_id, cid, channel, thread) VALUES (?, ?, ?, ?)",
+                                      (context.author.id, char['id'], key[1], key[2]))
+        except Exception:
+            self.proxies.pop(key, None)
+            raise
         to_delete = await context.send("Character proxied!")
         await asyncio.sleep(3)
         await to_delete.delete()
 
     @commands.command()
     async def unproxy(self, context: commands.Context, prefix: str):
-        char, found_prefix = self.fetch_char_info(prefix, context.author.id)
+        char, found_prefix = await self.fetch_char_info(prefix, context.author.id)
         if char is None or found_prefix is None:
             to_delete = await context.send("Character not found!")
             await asyncio.sleep(3)
             await to_delete.delete()
             return
-        channel = context.channel.id
-        thread = 0
-        if isinstance(context.channel, discord.Thread):
-            channel = context.channel.parent.id
-            thread = context.channel.id
-
-        self.bot.db.execute("DELETE FROM proxies WHERE user_id = ? AND cid = ? AND channel = ? AND thread = ?", (context.author.id, char['id'], channel, thread))
-        self.bot.connection.commit()
+        key = self.proxy_key(context.author.id, context.channel)
+        if self.proxies.get(key) == char["id"]:
+            del self.proxies[key]
+        await self.bot.db.execute("DELETE FROM proxies WHERE user_id = ? AND cid = ? AND channel = ? AND thread = ?",
+                                  (context.author.id, char['id'], key[1], key[2]))
         to_delete = await context.send("Character unproxied!")
         await asyncio.sleep(3)
         await to_delete.delete()
 
-    def handle_proxied_message(self, message: discord.Message) -> bool:
-        if isinstance(message.channel, discord.Thread):
-            channel = message.channel.parent.id
-        else:
-            channel = message.channel.id
-        resp = self.bot.db.execute("SELECT thread, cid FROM proxies WHERE user_id = ? AND channel = ?", (message.author.id,channel)).fetchall()
-        for i in resp:
-            if i["thread"] == message.channel.id:
-                char = self.bot.db.execute("SELECT * FROM characters WHERE id = ?", (i["cid"],)).fetchone()
+    @staticmethod
+    def proxy_key(user_id: int, channel) -> tuple[int, int, int]:
+        if isinstance(channel, discord.Thread):
+            return user_id, channel.parent_id, channel.id
+        return user_id, channel.id, 0
 
-                return char
+    async def handle_proxied_message(self, message: discord.Message):
+        cid = self.proxies.get(self.proxy_key(message.author.id, message.channel))
+        if cid is None:
+            return None
+        return await self.get_character(cid)
 
     def get_channel_cooldown(self, channel_id, category_id):
-        channel_info = self.bot.db.execute(
-            "SELECT * FROM channels WHERE id = ? AND whitelisted = 1", (channel_id,)).fetchone()
-        category_info = None
-        if not channel_info and category_id:
-            category_info = self.bot.db.execute(
-                "SELECT * FROM channels WHERE id = ? AND whitelisted = 1", (category_id,)).fetchone()
-            if not category_info:
-                return
-        if not channel_info and not category_info:
-            return
-
-        cooldown = channel_info["cooldown"] if channel_info is not None else category_info["cooldown"]
-        return cooldown
+        return self.channel_permissions.resolve(channel_id, category_id)
 
-    def get_character_cooldown(self, cid: int, channel: discord.TextChannel):
-        if cid in self.cooldowns:
-            for i in self.cooldowns[cid]:
-                if i.channel == channel:
-                    if i.cooldown <= 0:
-                        self.cooldowns[cid].remove(i)
-                        return False
-                    else:
-                        return True
-
-    async def send_message(self, webhook: discord.Webhook, message: discord.Message, char: dict, content: str):
+    async def send_message(self, channel, message: discord.Message, char: dict, content: str):
         kwargs = {
             "username": char["name"],
-            "avatar_url": self.api.format(char["id"]),
+            "avatar_url": self.avatar_api.format(char["id"]),
             "content": content,
             "wait": True
         }
 
         if message.reference is not None:
-            message_reference = await message.channel.fetch_message(message.reference.message_id)
-            jump_url = message_reference.jump_url
-            kwargs["content"] += f"\n\n[Replied message]({jump_url})"
+            kwargs["content"] += await self.reply_text(message)
         if isinstance(message.channel, discord.Thread):
             kwargs["thread"] = message.channel
-        await message.delete()
-        msg = await webhook.send(**kwargs)
-        await msg.add_reaction("✖")
-        await msg.add_reaction("❔")
-        await msg.add_reaction("📝")
-        await msg.add_reaction("📋")
-
-    async def create_webhook(self, channel):
-        webhooks = await channel.webhooks()
-        for i in webhooks:
-            if i.user.id == self.bot.user.id:
-                webhook = i
-                break
-        else:
-            webhook = await channel.create_webhook(name="hook")
-
-        return webhook
+        # sends are ordered per channel, the queue also deletes the original
+        msg = await self.outbound.send(channel, message, kwargs)
+        self.bot.milestone("first proxied message")
+        # the proxied message is visible now, the rest doesn't need to hold up the handler
+        self.spawn(self.after_send(msg, char), f"Post-send for {msg.id}")
+
+    async def reply_text(self, message: discord.Message) -> str:
+        # the reference has every id the link needs, only the optional preview needs the message itself
+        reference = message.reference
+        text = f"\n\n[Replied message]({reference.jump_url})"
+        if not self.bot.config.get_bool("reply_preview", False):
+            return text
+        replied = reference.resolved or reference.cached_message
+        if replied is None and reference.message_id is not None:
+            try:
+                replied = await message.channel.fetch_message(reference.message_id)
+            except discord.HTTPException:
+                return text
+        if not isinstance(replied, discord.Message) or not replied.content:
+            return text  # deleted, or nothing to quote
+        quote = discord.utils.escape_mentions(replied.content.replace("\n", " "))
+        if len(quote) > REPLY_PREVIEW_LENGTH:
+            quote = quote[:REPLY_PREVIEW_LENGTH - 1] + "…"
+        return f"\n\n> **{replied.author.display_name}**: {quote}\n[Replied message]({reference.jump_url})"
+
+    async def after_send(self, message: discord.WebhookMessage, char: dict):
+        await self.index_message(message, char)
+        for reaction in self.control_reactions:
+            await message.add_reaction(reaction)
+
+    def spawn(self, coro, name: str = None) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self.background.add(task)
+        task.add_done_callback(self.__background_done)
+        return task
+
+    def __background_done(self, task: asyncio.Task):
+        self.background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            traceback.print_exception(task.exception())
+
+    def pool_size(self, channel_id: int) -> int:
+        setting = self.channel_permissions.settings.get(channel_id)
+        return (setting.get("webhooks") if setting is not None else None) or self.bot.config.get_int("webhook_pool", 1)
+
+    async def get_webhooks(self, channel, refresh: bool = False) -> list[discord.Webhook]:
+        if refresh:
+            self.webhooks.invalidate(channel.id)
+        webhooks = await self.webhooks.get(channel.id, lambda: self.fetch_webhooks(channel))
+        return webhooks[:self.pool_size(channel.id)]
+
+    async def fetch_webhooks(self, channel) -> list[discord.Webhook]:
+        webhooks = [i for i in await channel.webhooks() if i.user is not None and i.user.id == self.bot.user.id]
+        # top the pool up to its configured size, extra webhooks are kept so their messages stay editable
+        for _ in range(self.pool_size(channel.id) - len(webhooks)):
+            webhooks.append(await channel.create_webhook(name="hook"))
+        return webhooks
 
-    async def set_cooldown(self, cooldown, channel, cid):
-        if cooldown > 0:
-            if cid not in self.cooldowns:
-                self.cooldowns[cid] = []
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel):
+        self.webhooks.invalidate(channel.id)
 
-            cooldown_obj = Cooldown(cid, channel, cooldown)
-            self.cooldowns[cid].append(cooldown_obj)
-            task = asyncio.create_task(self.cooldowns[cid][-1].run())
-            task.set_name(f"Cooldown for {cid} in {channel.id}")
-            task.add_done_callback(lambda _: self.cooldowns[cid].remove(cooldown_obj))
 
 async def setup(bot):
     await bot.add_cog(Character(bot))
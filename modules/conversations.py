@@ -0,0 +1,124 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+import discord
+
+
+class Conversation:
+    """One user's prompt in one channel. Their messages there are answers until it closes, answers sent before the
+    next question is asked queue up instead of being lost."""
+
+    def __init__(self, router: 'ConversationRouter', key: tuple[int, int], timeout: float):
+        self.router = router
+        self.key = key
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.answers: deque[discord.Message] = deque()
+        self.waiter: asyncio.Future = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    async def answer(self, timeout: float = None) -> discord.Message:
+        """The next message, raises asyncio.TimeoutError when none arrives in time, like wait_for did."""
+        if self.answers:
+            return self.answers.popleft()
+        if self.closed:
+            raise asyncio.TimeoutError()
+        self.deadline = time.monotonic() + (timeout or self.timeout)
+        self.waiter = asyncio.get_running_loop().create_future()
+        self.router.watch()
+        try:
+            return await self.waiter
+        finally:
+            self.waiter = None
+
+    def feed(self, message: discord.Message):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(message)
+        else:
+            self.answers.append(message)
+
+    def expire(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_exception(asyncio.TimeoutError())
+
+    def close(self):
+        self.closed = True
+        self.expire()
+        if self.router.conversations.get(self.key) is self:
+            del self.router.conversations[self.key]
+
+
+class ConversationRouter:
+    """Hands a user's messages to the prompt waiting on them in that channel.
+
+    Fed every message by CAGBot.dispatch, a dict lookup per message instead of a wait_for check per pending prompt.
+    Timeouts are swept by one task that only runs while prompts are open. A prompt nobody waits on past its deadline is
+    closed too, so one whose handler failed before closing it doesn't keep claiming the user's messages."""
+
+    def __init__(self, timeout: float = 120, resolution: float = 1.0, remembered: int = 1024):
+        self.timeout = timeout
+        self.resolution = resolution  # how late a timeout may fire
+        self.remembered = remembered
+        self.conversations: dict[tuple[int, int], Conversation] = {}  # (channel id, author id) -> open prompt
+        self.claimed: OrderedDict[int, None] = OrderedDict()  # ids of the latest messages taken as answers
+        self.sweeper: asyncio.Task = None
+        self.answered = self.expired = 0
+
+    def __len__(self):
+        return len(self.conversations)
+
+    def __str__(self):
+        return f"{len(self.conversations)} open, {self.answered} answers, {self.expired} timed out"
+
+    def open(self, channel_id: int, author_id: int, timeout: float = None) -> Conversation:
+        """Starts taking the author's messages in the channel, an earlier prompt of theirs there times out."""
+        key = (channel_id, author_id)
+        if key in self.conversations:
+            self.conversations[key].close()
+        conversation = self.conversations[key] = Conversation(self, key, timeout or self.timeout)
+        self.watch()
+        return conversation
+
+    def feed(self, message: discord.Message) -> bool:
+        conversation = self.conversations.get((message.channel.id, message.author.id))
+        if conversation is None:
+            return False
+        conversation.feed(message)
+        self.answered += 1
+        self.claimed[message.id] = None
+        if len(self.claimed) > self.remembered:
+            self.claimed.popitem(last=False)
+        return True
+
+    def is_claimed(self, message: discord.Message) -> bool:
+        # the conversation may already be closed by the time other listeners see its last answer
+        return message.id in self.claimed
+
+    def watch(self):
+        if self.sweeper is None:
+            self.sweeper = asyncio.create_task(self.sweep(), name="Conversation timeouts")
+
+    async def sweep(self):
+        try:
+            while self.conversations:
+                await asyncio.sleep(self.resolution)
+                now = time.monotonic()
+                for conversation in list(self.conversations.values()):
+                    if conversation.deadline <= now:
+                        self.expired += 1
+                        conversation.close()
+        finally:
+            self.sweeper = None
+
+    def close(self):
+        for conversation in list(self.conversations.values()):
+            conversation.close()
+        if self.sweeper is not None:
+            self.sweeper.cancel()
@@ -1,3 +1,6 @@
+import hashlib
+import time
+from collections import OrderedDict
 from types import TracebackType
 from typing import Union, Optional
 
@@ -9,13 +12,112 @@ import discord
 
 
 class TracebackHandler:
-    def __init__(self, _id: int, _error: str, _tb: Union[traceback.TracebackException, Optional[TracebackType]]):
+    def __init__(self, _id: int, _error: str, _tb: Union[str, Optional[TracebackType]], fingerprint: str = "",
+                 context: str = ""):
         self.id = _id
         self.error = _error
-        self.traceback = _tb
+        # rendered right away, holding on to the traceback would keep every frame and its locals alive
+        self.traceback = _tb if isinstance(_tb, str) else "".join(traceback.format_tb(_tb))
+        self.fingerprint = fingerprint
+        self.context = context
+        self.count = 1
+        self.first_seen = self.last_seen = time.time()
+        self.notified_at = 0.0
+        self.unreported = 0  # repeats since staff were last told
+
+    @classmethod
+    def from_row(cls, row):
+        handler = cls(row["id"], row["error"], row["traceback"], row["fingerprint"], row["context"])
+        handler.count, handler.first_seen, handler.last_seen = row["count"], row["first_seen"], row["last_seen"]
+        return handler
 
     def __str__(self):
-        return f'**{self.error}**\n{"".join(traceback.format_tb(self.traceback)).replace("ryan", "midnight")}'
+        seen = f"\nSeen {self.count} times" if self.count > 1 else ""
+        return f'**{self.error}**{seen}\n{self.traceback.replace("ryan", "midnight")}'
+
+
+class ErrorStore:
+    """The most recent errors live in memory, older ones overflow into the errors table."""
+
+    def __init__(self, db, size: int = 100, history: int = 5000, notify_interval: float = 300):
+        self.db = db
+        self.size = size
+        self.history = history  # rows kept in the errors table
+        self.notify_interval = notify_interval
+        self.recent: OrderedDict[int, TracebackHandler] = OrderedDict()  # least recently seen first
+        self.fingerprints: dict[str, int] = {}  # fingerprint -> id, for everything in recent
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.recent)
+
+    async def load(self):
+        row = await self.db.fetchone("SELECT MAX(id) AS id FROM errors")
+        self.next_id = max(self.next_id, row["id"] + 1 if row["id"] is not None else 0)
+
+    @staticmethod
+    def fingerprint(error: BaseException) -> str:
+        # same exception type raised from the same place, the message usually varies
+        frames = "".join(f"|{i.filename}:{i.lineno}:{i.name}" for i in traceback.extract_tb(error.__traceback__))
+        return hashlib.sha1(f"{type(error).__qualname__}{frames}".encode()).hexdigest()[:16]
+
+    async def capture(self, error: BaseException, context: str = "") -> tuple[TracebackHandler, bool]:
+        """Returns the error's record and whether staff should be told about it now."""
+        fingerprint = self.fingerprint(error)
+        now = time.time()
+        handler = self.recent.get(self.fingerprints.get(fingerprint))
+        if handler is not None:
+            handler.count += 1
+            handler.last_seen = now
+            self.recent.move_to_end(handler.id)
+        else:
+            handler = TracebackHandler(self.next_id, f"{error.__class__.__name__}: {str(error)}", error.__traceback__,
+                                       fingerprint, context)
+            self.next_id += 1
+            self.recent[handler.id] = handler
+            self.fingerprints[fingerprint] = handler.id
+            if len(self.recent) > self.size:
+                oldest = self.recent.popitem(last=False)[1]
+                del self.fingerprints[oldest.fingerprint]
+                await self.persist([oldest])
+        if now - handler.notified_at < self.notify_interval:
+            handler.unreported += 1
+            return handler, False
+        handler.notified_at = now
+        return handler, True
+
+    async def get(self, _id: int) -> Optional[TracebackHandler]:
+        if _id in self.recent:
+            return self.recent[_id]
+        row = await self.db.fetchone("SELECT * FROM errors WHERE id = ?", (_id,))
+        return TracebackHandler.from_row(row) if row is not None else None
+
+    async def delete(self, _id: int) -> Optional[TracebackHandler]:
+        handler = self.recent.pop(_id, None)
+        if handler is not None:
+            del self.fingerprints[handler.fingerprint]
+        else:
+            handler = await self.get(_id)
+        await self.db.execute("DELETE FROM errors WHERE id = ?", (_id,))
+        return handler
+
+    async def clear(self):
+        self.recent.clear()
+        self.fingerprints.clear()
+        await self.db.execute("DELETE FROM errors")
+
+    async def persist(self, handlers):
+        rows = [(i.id, i.fingerprint, i.error, i.traceback, i.context, i.count, i.first_seen, i.last_seen)
+                for i in handlers]
+        if not rows:
+            return
+        await self.db.transaction([
+            ("INSERT OR REPLACE INTO errors (id, fingerprint, error, traceback, context, count, first_seen, last_seen) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row) for row in rows
+        ] + [("DELETE FROM errors WHERE id <= ?", (self.next_id - 1 - self.history,))])
+
+    async def flush(self):
+        await self.persist(self.recent.values())
 
 
 class ErrorHandler(commands.Cog):
@@ -24,22 +126,27 @@ class ErrorHandler(commands.Cog):
 
     @commands.command()
     async def upload_error(self, context: commands.Context, errcode: str):
+        handler = await self.bot.errors.get(int(errcode))
+        if handler is None:
+            await context.send("Error code does not exist, returning.")
+            return
         f = io.BytesIO()
-        f.write(str(self.bot.traceback[int(errcode)]).encode('utf-8'))
+        f.write(str(handler).encode('utf-8'))
         f.seek(0)
         await context.send(file=discord.File(f, filename=f"error_{errcode}.txt"))
 
     # noinspection PyUnusedLocal
     @commands.command()
     async def print_error(self, context: commands.Context, errcode: str):
-        print(self.bot.traceback[int(errcode)])
+        print(await self.bot.errors.get(int(errcode)))
 
     @commands.command(aliases=["show_error"])
     async def get_error(self, context: commands.Context, errcode: str):
-        try:
-            await context.send("```\n" + str(self.bot.traceback[int(errcode)]) + "\n```")
-        except KeyError:
+        handler = await self.bot.errors.get(int(errcode))
+        if handler is None:
             await context.send("Error code does not exist, returning.")
+            return
+        await context.send("```\n" + str(handler) + "\n```")
 
     @commands.Cog.listener()
     async def on_command_error(self, context: commands.Context, error: commands.errors.CommandError):
@@ -49,29 +156,21 @@ class ErrorHandler(commands.Cog):
             error: commands.MissingRequiredArgument
             await context.send(f"Missing required argument: {error.param}")
             return
-        err_code = 255
-        for i in range(len(self.bot.traceback) + 1):
-            if i in self.bot.traceback:
-                continue
-            err_code = i
-        await context.send(f"""{error}\nError code {err_code}""")
         original = getattr(error, 'original', error)
-        handler = TracebackHandler(err_code, f"{error.__class__.__name__}: {str(error)}", original.__traceback__)
-        self.bot.traceback[err_code] = handler
+        handler, _ = await self.bot.errors.capture(original, f"command {context.command}")
+        await context.send(f"""{error}\nError code {handler.id}""")
 
     @commands.command()
     async def del_error(self, context: commands.Context, errcode: str):
-        try:
-            temp = self.bot.traceback[int(errcode)]
-            del self.bot.traceback[int(errcode)]
-        except KeyError:
+        temp = await self.bot.errors.delete(int(errcode))
+        if temp is None:
             await context.send(f"Error {errcode} does not exist.")
             return
         await context.send(f"Traceback {errcode} deleted. Contents:\n{str(temp)}")
 
     @commands.command()
     async def clear_errors(self, context: commands.Context):
-        self.bot.traceback = {}
+        await self.bot.errors.clear()
         await context.send("Traceback cache cleared.")
 
     # @commands.command()
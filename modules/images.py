@@ -0,0 +1,111 @@
+import asyncio
+import os
+import tempfile
+import traceback
+from collections import OrderedDict
+from typing import Optional
+
+import aiohttp
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageDownloader:
+    def __init__(self, bot, directory: str = "images", max_bytes: int = 8 * 1024 * 1024, timeout: float = 20,
+                 concurrency: int = 4):
+        self.bot = bot
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.concurrency = concurrency
+        # cid -> url still to download, drained by at most `concurrency` workers so a bulk import of thousands of
+        # images doesn't park a task per image
+        self.queued: OrderedDict[int, str] = OrderedDict()
+        self.workers: set[asyncio.Task] = set()
+        self.pending: dict[int, asyncio.Task] = {}  # cid -> download in flight
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, cid: int) -> str:
+        return os.path.join(self.directory, f"{cid}.png")
+
+    def __len__(self):
+        return len(self.queued) + len(self.pending)
+
+    def schedule(self, cid: int, url: Optional[str]):
+        # a newer image for the same character supersedes the one queued or still downloading
+        self.cancel(cid)
+        if not url:
+            return  # >cc without an image, or an image edited away
+        self.queued[cid] = url
+        if len(self.workers) < self.concurrency:
+            worker = asyncio.create_task(self.work(), name="Image downloads")
+            self.workers.add(worker)
+            worker.add_done_callback(self.workers.discard)
+
+    def cancel(self, cid: int):
+        self.queued.pop(cid, None)
+        task = self.pending.pop(cid, None)
+        if task is not None:
+            task.cancel()
+
+    def cancel_all(self):
+        self.queued.clear()
+        for task in self.workers:
+            task.cancel()
+        for task in self.pending.values():
+            task.cancel()
+        self.pending.clear()
+
+    async def work(self):
+        # exits once the queue is empty, schedule starts new workers as needed
+        while self.queued:
+            cid, url = self.queued.popitem(last=False)
+            # its own task, so cancel() can stop this download without stopping the worker
+            task = self.pending[cid] = asyncio.create_task(self.download(cid, url), name=f"Image download for {cid}")
+            try:
+                await task
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise  # the worker itself was cancelled
+            except Exception:
+                traceback.print_exc()
+            finally:
+                if self.pending.get(cid) is task:
+                    del self.pending[cid]
+
+    async def download(self, cid: int, url: str) -> bool:
+        try:
+            return await asyncio.wait_for(self.__download(cid, url), self.timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, TypeError, OSError) as e:
+            print(f"Failed to download image for character {cid}: {e!r}")
+            return False
+
+    async def __download(self, cid: int, url: str) -> bool:
+        loop = asyncio.get_running_loop()
+        async with self.bot.http_session.get(url) as resp:
+            if resp.status != 200:
+                return False
+            if not resp.content_type.startswith("image/"):
+                raise ValueError(f"not an image: {resp.content_type}")
+            if resp.content_length is not None and resp.content_length > self.max_bytes:
+                raise ValueError(f"image too large: {resp.content_length} bytes")
+            fd, temp = await loop.run_in_executor(None, lambda: tempfile.mkstemp(dir=self.directory,
+                                                                                 suffix=".part"))
+            file = os.fdopen(fd, "wb")
+            try:
+                size = 0
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ValueError(f"image larger than {self.max_bytes} bytes")
+                    await loop.run_in_executor(None, file.write, chunk)
+                await loop.run_in_executor(None, file.close)
+                # readers only ever see the old image or the complete new one
+                await loop.run_in_executor(None, os.replace, temp, self.path(cid))
+            except BaseException:
+                file.close()
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+        self.bot.dispatch("character_image_updated", cid)
+        return True
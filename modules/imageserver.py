@@ -0,0 +1,101 @@
+import asyncio
+import glob
+import os
+import re
+
+from aiohttp import web
+from discord.ext import commands
+
+try:
+    from PIL import Image
+except ImportError:  # resized variants are optional, the originals are served either way
+    Image = None
+
+
+class ImageServer(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.config = self.bot.config.get("image_server") or {}
+        self.directory = self.config.get("directory", "images")
+        self.sizes = sorted(self.config.get("sizes", [64, 128, 256]))
+        self.max_age = self.config.get("max_age", 7 * 86400)
+        self.runner: web.AppRunner = None
+        self.variant_task: asyncio.Task = None
+
+    async def cog_load(self):
+        if not self.config.get("enabled", False):
+            return
+        app = web.Application()
+        app.router.add_get(r"/images/{cid:\d+}", self.serve)
+        app.router.add_get(r"/images/{cid:\d+}/{size:\d+}", self.serve)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.config.get("host", "127.0.0.1"), self.config.get("port", 8080)).start()
+        print(f"Serving {self.directory} on {self.config.get('host', '127.0.0.1')}:{self.config.get('port', 8080)}")
+        if Image is not None:
+            self.variant_task = asyncio.create_task(self.generate_missing_variants(), name="Avatar variants")
+
+    async def cog_unload(self):
+        if self.variant_task is not None:
+            self.variant_task.cancel()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def path(self, cid: int, size: int = None) -> str:
+        return os.path.join(self.directory, f"{cid}.png" if size is None else f"{cid}_{size}.png")
+
+    async def serve(self, request: web.Request):
+        cid = int(request.match_info["cid"])
+        path = self.path(cid)
+        if "size" in request.match_info:
+            # serve the smallest variant at least as large as requested, or the original
+            size = int(request.match_info["size"])
+            for i in self.sizes:
+                if i >= size and os.path.exists(self.path(cid, i)):
+                    path = self.path(cid, i)
+                    break
+        if not os.path.exists(path):
+            raise web.HTTPNotFound()
+        # FileResponse handles ETag/Last-Modified revalidation and uses sendfile where available
+        return web.FileResponse(path, headers={"Cache-Control": f"public, max-age={self.max_age}"})
+
+    def generate_variants(self, cid: int):
+        try:
+            with Image.open(self.path(cid)) as image:
+                image.load()
+                for size in self.sizes:
+                    variant = image.copy()
+                    variant.thumbnail((size, size))
+                    temp = self.path(cid, size) + ".part"
+                    variant.save(temp, format="PNG", optimize=True)
+                    os.replace(temp, self.path(cid, size))
+        except (OSError, ValueError) as e:
+            print(f"Failed to resize image for character {cid}: {e!r}")
+
+    def remove_variants(self, cid: int):
+        for size in self.sizes:
+            if os.path.exists(self.path(cid, size)):
+                os.remove(self.path(cid, size))
+
+    async def generate_missing_variants(self):
+        loop = asyncio.get_running_loop()
+        for path in await loop.run_in_executor(None, glob.glob, os.path.join(self.directory, "*.png")):
+            match = re.fullmatch(r"(\d+)\.png", os.path.basename(path))
+            if match is None:
+                continue
+            cid = int(match.group(1))
+            if not all(os.path.exists(self.path(cid, size)) for size in self.sizes):
+                await loop.run_in_executor(None, self.generate_variants, cid)
+
+    @commands.Cog.listener()
+    async def on_character_image_updated(self, cid: int):
+        if self.runner is not None and Image is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.generate_variants, cid)
+
+    @commands.Cog.listener()
+    async def on_character_image_deleted(self, cid: int):
+        await asyncio.get_running_loop().run_in_executor(None, self.remove_variants, cid)
+
+
+async def setup(bot):
+    await bot.add_cog(ImageServer(bot))
@@ -1,13 +1,21 @@
 import asyncio
+import re
 
 import discord
 from discord.ext import commands
-import re
+
+from modules.validator import TemplateValidator, ValidationTimeout
+
+# forum channel id -> config key of the pattern its posts must match, overridden by "template_forums"
+TEMPLATE_FORUMS = {"1276234389004484672": "template_regex", "1277315286424485991": "npc_regex"}
 
 
 class Listeners(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.validator = TemplateValidator(self.bot.config.get_float("template_timeout", 2.0),
+                                           self.bot.config.get_int("template_processes", 1))
+        self.loading: asyncio.Task = None
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
@@ -22,28 +30,61 @@ class Listeners(commands.Cog):
             message = await self.bot.get_channel(payload.channel_id).fetch_message(payload.message_id)
             await message.delete()
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.thread is not None and len(message.attachments):
-            regex = None
-            if message.thread.parent_id == 1276234389004484672:
-                regex = self.bot.config["template_regex"]
+    async def cog_load(self):
+        # starting the workers takes the better part of a second, posts that arrive meanwhile wait in match()
+        self.loading = asyncio.create_task(self.load_templates(), name="Template workers")
+        self.bot.config.subscribe(self.on_config_change)
 
-            elif message.thread.parent_id == 1277315286424485991:
-                regex = self.bot.config["npc_regex"]
+    async def cog_unload(self):
+        self.bot.config.unsubscribe(self.on_config_change)
+        if self.loading is not None:
+            await asyncio.wait([self.loading])
+        await self.validator.close()
 
-            if regex is None:
-                return
-            if re.fullmatch(regex, message.content) and len(message.attachments):
-                return
-            await message.thread.delete()
+    async def load_templates(self):
+        forums = self.bot.config.get("template_forums", TEMPLATE_FORUMS)
+        self.validator.timeout = self.bot.config.get_float("template_timeout", 2.0)
+        # a forum with a missing or broken pattern goes unchecked, the others keep being validated
+        patterns = {}
+        for forum_id, key in forums.items():
+            pattern = self.bot.config.get(key)
+            if pattern is None:
+                print(f"No template pattern {key} in the config, not checking posts in forum {forum_id}")
+                continue
             try:
-                await message.author.send("Template matching failed. Please make sure that you used the template. If you think there was an issue, contact either Meg or Ryan.")
-                await message.author.send("Content of your post for editing: \n```\n" + message.content + "\n```")
-            except discord.Forbidden:
-                await (self.bot.get_channel(self.bot.config["staff_botspam"])).send(f"{message.author.mention}: Template matching for your character failed. Please make sure that you used the template. If you think there was an issue, contact either Meg or Ryan.")
-                await (self.bot.get_channel(self.bot.config["staff_botspam"])).send("Content of your post for editing: \n```\n" + message.content + "\n```")
+                re.compile(pattern)
+            except re.error as e:
+                print(f"Invalid template pattern {key}, not checking posts in forum {forum_id}: {e!r}")
+                continue
+            patterns[int(forum_id)] = pattern
+        await self.validator.load(patterns)
+
+    async def on_config_change(self, changed: set[str]):
+        # the pattern keys are named by template_forums, so this can't subscribe to fixed keys
+        forums = self.bot.config.get("template_forums", TEMPLATE_FORUMS)
+        if changed & {"template_forums", "template_timeout", *forums.values()}:
+            await self.load_templates()
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.thread is None or not len(message.attachments) or message.thread.parent_id not in self.validator:
+            return
+        try:
+            if await self.validator.match(message.thread.parent_id, message.content):
+                return
+        except ValidationTimeout:
+            await self.bot.get_channel(self.bot.config["staff_botspam"]).send(
+                f"Template matching for {message.thread.mention} by {message.author.mention} timed out, "
+                f"please check it by hand.")
+            return
 
+        await message.thread.delete()
+        try:
+            await message.author.send("Template matching failed. Please make sure that you used the template. If you think there was an issue, contact either Meg or Ryan.")
+            await message.author.send("Content of your post for editing: \n```\n" + message.content + "\n```")
+        except discord.Forbidden:
+            await (self.bot.get_channel(self.bot.config["staff_botspam"])).send(f"{message.author.mention}: Template matching for your character failed. Please make sure that you used the template. If you think there was an issue, contact either Meg or Ryan.")
+            await (self.bot.get_channel(self.bot.config["staff_botspam"])).send("Content of your post for editing: \n```\n" + message.content + "\n```")
 
 
 async def setup(bot):
@@ -0,0 +1,175 @@
+import asyncio
+import time
+import traceback
+from collections import defaultdict
+from typing import Awaitable, Callable
+
+import discord
+
+WebhookGetter = Callable[..., Awaitable[list[discord.Webhook]]]
+
+
+class RateLimiter:
+    """Token bucket, lets `rate` requests through every `per` seconds."""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.allowance = float(rate)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self.allowance = min(self.rate, self.allowance + (now - self.updated) * self.rate / self.per)
+            self.updated = now
+            if self.allowance >= 1:
+                self.allowance -= 1
+                return
+            await asyncio.sleep((1 - self.allowance) * self.per / self.rate)
+
+    def available(self) -> float:
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return -(self.blocked_until - now) * self.rate / self.per
+        return min(self.rate, self.allowance + (now - self.updated) * self.rate / self.per)
+
+    def backoff(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class Outgoing:
+    __slots__ = ("channel", "original", "kwargs", "enqueued", "future")
+
+    def __init__(self, channel, original: discord.Message, kwargs: dict):
+        self.channel = channel  # the channel owning the webhook, the thread's parent for threads
+        self.original = original
+        self.kwargs = kwargs
+        self.enqueued = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class OutboundQueue:
+    def __init__(self, get_webhooks: WebhookGetter, rate: int = 5, per: float = 2.0, idle: float = 60):
+        self.get_webhooks = get_webhooks  # (channel, refresh=False) -> the channel's webhook pool
+        self.idle = idle
+        self.queues: dict[int, asyncio.Queue] = {}  # message channel id -> pending sends, in arrival order
+        self.workers: dict[int, asyncio.Task] = {}
+        self.deleting: set[asyncio.Task] = set()
+        self.rate, self.per = rate, per
+        self.limiters: defaultdict[int, RateLimiter] = defaultdict(lambda: RateLimiter(self.rate, self.per))
+        self.sent = self.failed = self.bulk_deletes = 0
+        self.total_wait = self.max_wait = 0.0
+        self.max_depth = 0
+
+    def set_rate(self, rate: int, per: float):
+        self.rate, self.per = rate, per
+        for limiter in self.limiters.values():
+            limiter.rate, limiter.per = rate, per
+
+    def __len__(self):
+        return sum(i.qsize() for i in self.queues.values())
+
+    def __str__(self):
+        average = self.total_wait / self.sent if self.sent else 0
+        return (f"{len(self)} queued in {len(self.workers)} channels (max depth {self.max_depth}), {self.sent} sent, "
+                f"{self.failed} failed, {self.bulk_deletes} bulk deletes, wait avg {average * 1000:.1f}ms "
+                f"max {self.max_wait * 1000:.1f}ms")
+
+    async def send(self, channel, original: discord.Message, kwargs: dict) -> discord.WebhookMessage:
+        job = Outgoing(channel, original, kwargs)
+        key = original.channel.id
+        queue = self.queues.setdefault(key, asyncio.Queue())
+        queue.put_nowait(job)
+        self.max_depth = max(self.max_depth, queue.qsize())
+        worker = self.workers.get(key)
+        if worker is None or worker.done():
+            self.workers[key] = asyncio.create_task(self.run(key, queue), name=f"Outbound queue for {key}")
+        return await job.future
+
+    async def close(self):
+        for worker in self.workers.values():
+            worker.cancel()
+        for queue in self.queues.values():
+            while not queue.empty():
+                queue.get_nowait().future.cancel()
+        self.workers.clear()
+        self.queues.clear()
+
+    async def run(self, key: int, queue: asyncio.Queue):
+        originals = []
+        while True:
+            try:
+                job = await asyncio.wait_for(queue.get(), self.idle) if queue.empty() else queue.get_nowait()
+            except asyncio.TimeoutError:
+                if queue.empty():  # nothing can be queued between this check and returning
+                    del self.workers[key]
+                    del self.queues[key]
+                    return
+                continue
+            wait = time.monotonic() - job.enqueued
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            try:
+                message = await self.deliver(job)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self.sent += 1
+                originals.append(job.original)
+                if not job.future.done():
+                    job.future.set_result(message)
+            # coalesce the deletes of everything sent while the channel was busy, without holding up the next send
+            if originals and (queue.empty() or len(originals) >= 10):
+                task = asyncio.create_task(self.delete_originals(originals))
+                self.deleting.add(task)
+                task.add_done_callback(self.deleting.discard)
+                originals = []
+
+    def pick(self, webhooks: list[discord.Webhook]) -> discord.Webhook:
+        # least loaded first, i.e. the one with the most requests left in its bucket
+        return max(webhooks, key=lambda i: self.limiters[i.id].available())
+
+    async def deliver(self, job: Outgoing) -> discord.WebhookMessage:
+        webhooks = await self.get_webhooks(job.channel)
+        for attempt in range(2):
+            webhook = self.pick(webhooks)
+            limiter = self.limiters[webhook.id]
+            await limiter.acquire()
+            try:
+                return await webhook.send(**job.kwargs)
+            except discord.NotFound:
+                if attempt:
+                    raise
+                # the cached webhook was deleted behind our back, look the pool up again once
+                webhooks = await self.get_webhooks(job.channel, refresh=True)
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt:
+                    raise
+                limiter.backoff(getattr(e, "retry_after", None) or limiter.per)
+
+    async def delete_originals(self, originals: list[discord.Message]):
+        channel = originals[0].channel
+        if len(originals) > 1:
+            try:
+                await channel.delete_messages(originals)
+                self.bulk_deletes += 1
+                return
+            except discord.HTTPException:
+                pass  # e.g. one of them is already gone, fall back to deleting them one by one
+        for original in originals:
+            try:
+                await original.delete()
+            except discord.NotFound:
+                pass
+            except discord.HTTPException:
+                traceback.print_exc()
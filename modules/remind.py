@@ -1,17 +1,24 @@
 import asyncio
-import datetime
+import heapq
 import re
+import sqlite3
 import time
+import traceback
 
-import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
+
+HORIZON = 3600  # reminders due within this many seconds are kept in memory
+RETRY_DELAY = 5  # seconds before reloading reminders again after the database failed
 
 
 class Remind(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.bot.db.execute("CREATE TABLE IF NOT EXISTS reminders (id INTEGER PRIMARY KEY, user_id INTEGER, channel INTEGER, time INTEGER, phrase TEXT, jump_url TEXT)")
-        self.bot.connection.commit()
+        self.heap: list[tuple[float, int]] = []
+        self.reminders: dict[int, dict] = {}  # id -> reminder, for everything in the heap
+        self.horizon = 0.0  # every reminder due before this is in the heap
+        self.wakeup = asyncio.Event()
+        self.scheduler = None
 
     @commands.command()
     async def remind(self, context: commands.Context, _time, *, phrase):
@@ -29,33 +36,85 @@ class Remind(commands.Cog):
                 seconds += temp * 60
             else:
                 seconds += temp
-        old_time = time.time()
-        new_time = datetime.datetime.fromtimestamp(old_time + seconds, datetime.timezone.utc)
-        timestamp = old_time + seconds
-        self.bot.db.execute("INSERT INTO reminders (user_id, channel, time, phrase, jump_url) VALUES (?, ?, ?, ?, ?)",
-                            (context.author.id, context.channel.id, timestamp, phrase, context.message.jump_url))
-        self.bot.connection.commit()
+        timestamp = time.time() + seconds
+        result = await self.bot.db.execute(
+            "INSERT INTO reminders (user_id, channel, time, phrase, jump_url) VALUES (?, ?, ?, ?, ?)",
+            (context.author.id, context.channel.id, timestamp, phrase, context.message.jump_url))
+        self.schedule({"id": result.lastrowid, "user_id": context.author.id, "channel": context.channel.id,
+                       "time": timestamp, "phrase": phrase, "jump_url": context.message.jump_url})
         await context.send("Reminder " + phrase + " created for " + _time + "!")
-        await discord.utils.sleep_until(new_time)
-        await context.send(f"{context.author.mention}: {phrase}\nMessage: {context.message.jump_url}")
-        self.bot.db.execute("DELETE FROM reminders WHERE jump_url = ?", (context.message.jump_url,))
-        self.bot.connection.commit()
 
     async def cog_load(self):
-        reminders = self.bot.db.execute("SELECT * FROM reminders").fetchall()
+        self.start_scheduler()
+
+    def start_scheduler(self):
+        self.scheduler = asyncio.create_task(self.run_scheduler(), name="Reminder scheduler")
+        self.scheduler.add_done_callback(self.scheduler_done)
+
+    def scheduler_done(self, task: asyncio.Task):
+        if task.cancelled() or task is not self.scheduler:
+            return
+        # it's the only thing firing reminders, so it can't stay dead
+        traceback.print_exception(task.exception())
+        print("Reminder scheduler stopped, restarting it")
+        self.start_scheduler()
+
+    async def cog_unload(self):
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+
+    def schedule(self, reminder):
+        if reminder["time"] >= self.horizon or reminder["id"] in self.reminders:
+            return  # picked up from the database once the horizon reaches it
+        self.reminders[reminder["id"]] = dict(reminder)
+        heapq.heappush(self.heap, (reminder["time"], reminder["id"]))
+        if self.heap[0][1] == reminder["id"]:
+            self.wakeup.set()
+
+    async def extend_horizon(self):
+        horizon = time.time() + HORIZON
+        try:
+            reminders = await self.bot.db.fetchall("SELECT * FROM reminders WHERE time >= ? AND time < ?",
+                                                   (self.horizon, horizon))
+        except sqlite3.Error:
+            traceback.print_exc()
+            return  # the horizon stays put, so the next wakeup tries again
+        self.horizon = horizon
         for reminder in reminders:
-            asyncio.create_task(self.remind_task(reminder))
-        print("Done loading reminders!")
+            self.schedule(reminder)
+
+    async def run_scheduler(self):
+        await self.bot.wait_until_ready()
+        await self.extend_horizon()
+        print(f"Done loading reminders! {len(self.heap)} due in the next {HORIZON} seconds")
+        while True:
+            now = time.time()
+            if now >= self.horizon - HORIZON / 2:
+                await self.extend_horizon()
+            while self.heap and self.heap[0][0] <= now:
+                _, rid = heapq.heappop(self.heap)
+                await self.send_reminder(self.reminders.pop(rid))
+            # retries a failed extend_horizon after a few seconds instead of spinning on it
+            next_wakeup = max(self.horizon - HORIZON / 2, now + RETRY_DELAY)
+            if self.heap:
+                next_wakeup = min(self.heap[0][0], next_wakeup)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(0.0, next_wakeup - time.time()))
+            except asyncio.TimeoutError:
+                pass
 
-    async def remind_task(self, reminder):
-        user = self.bot.get_user(reminder["user_id"])
+    async def send_reminder(self, reminder):
         channel = self.bot.get_channel(reminder["channel"])
-        print("Sleeping until " + str(
-            datetime.datetime.fromtimestamp(reminder["time"], datetime.timezone.utc)) + " for " + reminder["phrase"])
-        await discord.utils.sleep_until(datetime.datetime.fromtimestamp(reminder["time"], datetime.timezone.utc))
-        await channel.send(f"{user.mention}: {reminder['phrase']}\nMessage: {reminder['jump_url']}")
-        self.bot.db.execute("DELETE FROM reminders WHERE id = ?", (reminder["id"],))
-        self.bot.connection.commit()
+        try:
+            if channel is not None:
+                await channel.send(f"<@{reminder['user_id']}>: {reminder['phrase']}\nMessage: {reminder['jump_url']}")
+        except Exception:
+            traceback.print_exc()
+        try:
+            await self.bot.db.execute("DELETE FROM reminders WHERE id = ?", (reminder["id"],))
+        except sqlite3.Error:
+            traceback.print_exc()  # sent already, worst case it's sent again after a restart
 
 
 async def setup(bot):
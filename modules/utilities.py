@@ -6,19 +6,12 @@ from discord.ext import commands
 import discord
 import json
 
+import migrations
+
 
 class Utilities(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.bot.config_file = 'config.json'
-
-        def update_config():
-            with open(self.bot.config_file, 'w') as conf:
-                print("Writing config to file...")
-                print(json.dumps(self.bot.config, ensure_ascii=True, indent=2))
-                conf.write(json.dumps(self.bot.config, ensure_ascii=True, indent=2))
-
-        self.bot.update_config = update_config
 
     BOT_PREFIX = '>'
 
@@ -29,13 +22,11 @@ class Utilities(commands.Cog):
         await self.bot.change_presence(status=discord.Status.online, activity=game)
         await context.send(f"Status changed to: {status}" if status != "" else "Reset status")
         self.bot.config["status"] = status
-        self.bot.update_config()
 
     @commands.command(aliases=["kill", "stop"], help="Kills the bot")
     @commands.is_owner()
     async def die(self, context):
         await context.send("Bot shutting down...")
-        self.bot.db.close()
         await self.bot.close()
 
     @commands.command(help=f"Will unload a cog.\nUsage: {BOT_PREFIX}unload cogname", brief="Will unload a cog.",
@@ -95,17 +86,27 @@ class Utilities(commands.Cog):
     @commands.is_owner()
     async def reload_all(self, ctx: commands.Context):
         """Reloads all cogs"""
+        failed = []
         for cog in self.bot.all_cogs:
             try:
-                await self.bot.unload_extension(cog)
+                if cog in self.bot.extensions:
+                    await self.bot.unload_extension(cog)
                 await self.bot.load_extension(cog)
-                self.bot.loaded_cogs.append(cog)
-                self.bot.unloaded_cogs.remove(cog)
             except Exception as e:
-                self.bot.traceback[cog] = e
-                self.bot.unloaded_cogs.append(cog)
-                self.bot.loaded_cogs.remove(cog)
-        await ctx.send("Reloaded all cogs")
+                handler, _ = await self.bot.errors.capture(e, f"reloading {cog}")
+                failed.append(f"{cog} (error {handler.id})")
+            # the extension is either fully loaded or not at all, keep the lists in step with it
+            if cog in self.bot.extensions:
+                if cog not in self.bot.loaded_cogs:
+                    self.bot.loaded_cogs.append(cog)
+                if cog in self.bot.unloaded_cogs:
+                    self.bot.unloaded_cogs.remove(cog)
+            else:
+                if cog in self.bot.loaded_cogs:
+                    self.bot.loaded_cogs.remove(cog)
+                if cog not in self.bot.unloaded_cogs:
+                    self.bot.unloaded_cogs.append(cog)
+        await ctx.send("Reloaded all cogs" + (f", failed: {', '.join(failed)}" if failed else ""))
 
     @commands.command()
     @commands.is_owner()
@@ -131,13 +132,20 @@ class Utilities(commands.Cog):
         embed.add_field(name="Other Info", value="Created with discord.py", inline=False)
         await context.send(embed=embed)
 
+    @commands.command(aliases=["stats"])
+    @commands.is_owner()
+    async def metrics(self, context):
+        summary = self.bot.startup_report() + "\n\n" + self.bot.metrics.summary()
+        if len(summary) > 1900:
+            summary = summary[:1900] + "\n..."
+        await context.send(f"```\n{summary}\n```")
+
     @commands.is_owner()
     @commands.command(aliases=['rlconfig'])
     async def reload_config(self, context):
-        with open('config.json') as config_file:
-            config = json.load(config_file)
-            self.bot.config = config
-            await context.send("Config reloaded!")
+        changed = await self.bot.config.reload()
+        await context.send(f"Config reloaded! Changed: {', '.join(sorted(changed))}" if changed else
+                           "Config reloaded, nothing changed.")
 
     @commands.is_owner()
     @commands.command()
@@ -145,8 +153,6 @@ class Utilities(commands.Cog):
         if all(i.isdigit() for i in value):
             value = int(value)
         self.bot.config[key] = value
-        self.bot.update_config()
-        await self.reload_config(context)
         await context.send(f"Config Updated! Key {key} updated with value {value}")
 
     @commands.command()
@@ -157,7 +163,7 @@ class Utilities(commands.Cog):
     @commands.command()
     @commands.is_owner()
     async def dump_config(self, context):
-        data = json.JSONEncoder().encode(self.bot.config)
+        data = json.JSONEncoder().encode(self.bot.config.data)
         obj = json.loads(data)
         string = json.dumps(obj, ensure_ascii=True, indent=2)
         await context.send(
@@ -168,9 +174,14 @@ class Utilities(commands.Cog):
     @commands.command()
     @commands.is_owner()
     async def execute(self, context, *, query):
-        resp = self.bot.db.execute(query).fetchall()
-        self.bot.connection.commit()
-        await context.send(f"Query processed. Rows found: {len(resp)}")
+        resp = await self.bot.db.execute(query)
+        await context.send(f"Query processed. Rows found: {len(resp.rows)}")
+
+    @commands.command()
+    @commands.is_owner()
+    async def analyze(self, context):
+        await self.bot.db.write(migrations.analyze)
+        await context.send("Database statistics updated!")
 
     @commands.command()
     @commands.is_owner()
@@ -0,0 +1,127 @@
+import asyncio
+import multiprocessing
+import re
+
+# compiled once per worker process by the pool initializer
+_patterns: dict[int, re.Pattern] = {}
+
+
+def _load(patterns: dict[int, str]):
+    global _patterns
+    _patterns = {forum_id: re.compile(pattern) for forum_id, pattern in patterns.items()}
+
+
+def _match(forum_id: int, content: str) -> bool:
+    return _patterns[forum_id].fullmatch(content) is not None
+
+
+def _ready() -> bool:
+    return True
+
+
+class ValidationTimeout(Exception):
+    pass
+
+
+class PoolRestarted(Exception):
+    pass
+
+
+class TemplateValidator:
+    """Matches posts against their forum's template in worker processes, a pattern that backtracks forever only costs
+    a worker instead of the event loop."""
+
+    def __init__(self, timeout: float = 2.0, processes: int = 1):
+        self.timeout = timeout
+        self.processes = processes
+        # spawn, forking a process with a running event loop and thread pools isn't safe
+        self.context = multiprocessing.get_context("spawn")
+        self.patterns: dict[int, str] = {}
+        self.pool = None
+        self.pending: dict[asyncio.Future, object] = {}  # match in flight -> pool it was submitted to
+        self.restarting: asyncio.Future = None
+        self.matches = self.timeouts = 0
+
+    def __contains__(self, forum_id: int):
+        return forum_id in self.patterns
+
+    def __str__(self):
+        return f"{len(self.patterns)} templates, {self.matches} matches, {self.timeouts} timeouts"
+
+    async def load(self, patterns: dict[int, str]):
+        for pattern in patterns.values():
+            re.compile(pattern)  # raises re.error here instead of in every worker
+        if self.restarting is not None:
+            await asyncio.shield(self.restarting)
+        self.patterns = dict(patterns)
+        await self.restart()
+
+    async def match(self, forum_id: int, content: str) -> bool:
+        """Raises ValidationTimeout when the pattern doesn't finish in time, the workers are replaced in that case."""
+        while True:
+            if self.pool is None and self.restarting is not None:
+                await asyncio.shield(self.restarting)  # the first workers are still starting
+            pool = self.pool
+            try:
+                result = await asyncio.wait_for(self.__submit(pool, forum_id, content), self.timeout)
+                self.matches += 1
+                return result
+            except asyncio.TimeoutError:
+                if pool is self.pool and self.restarting is None:
+                    self.timeouts += 1
+                    await self.restart()
+                    raise ValidationTimeout(f"template match in {forum_id} took longer than {self.timeout}s")
+            except PoolRestarted:
+                pass
+            # the pool was replaced while this match waited on it, try again on the new one
+            if self.restarting is not None:
+                await asyncio.shield(self.restarting)
+
+    def __submit(self, pool, forum_id: int, content: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result, error):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        self.pending[future] = pool
+        future.add_done_callback(lambda f: self.pending.pop(f, None))
+        # the callbacks run on the pool's result thread
+        pool.apply_async(_match, (forum_id, content), callback=lambda r: loop.call_soon_threadsafe(resolve, r, None),
+                         error_callback=lambda e: loop.call_soon_threadsafe(resolve, None, e))
+        return future
+
+    async def restart(self):
+        if self.restarting is None:
+            self.restarting = asyncio.ensure_future(self.__restart())
+        await asyncio.shield(self.restarting)
+
+    async def __restart(self):
+        loop = asyncio.get_running_loop()
+        try:
+            pool = await loop.run_in_executor(None, self.__start_pool)
+            old, self.pool = self.pool, pool
+            for future, owner in list(self.pending.items()):
+                if owner is old and not future.done():
+                    future.set_exception(PoolRestarted())
+            if old is not None:
+                await loop.run_in_executor(None, old.terminate)
+        finally:
+            self.restarting = None
+
+    def __start_pool(self):
+        if not self.patterns:
+            return None
+        pool = self.context.Pool(self.processes, initializer=_load, initargs=(self.patterns,))
+        pool.apply(_ready)  # don't hand out a pool whose workers are still importing
+        return pool
+
+    async def close(self):
+        if self.pool is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.pool.terminate)
+            self.pool = None